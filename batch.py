@@ -0,0 +1,166 @@
+"""Evaluate the cell graph over many returns at once with NumPy.
+
+Each input cell is a column with one entry per return, and each calc is run
+once per batch as array arithmetic, in the same topological order the scalar
+Engine uses. max/min become np.maximum/np.minimum and IF becomes np.where, so
+every row takes its own branch.
+
+Returns are grouped by their interview answers first. Within a group the filing
+status, kids, etc. are plain scalars, so the taxforms.py helpers that branch on
+them (std_ded_fn, fstatus() in the Fswitch chains, ...) run unchanged, once per
+group. Helpers that take cell values get an array version where there is one
+(tax_calc); the rest are applied row by row with np.vectorize.
+"""
+
+import ast
+import types
+from functools import reduce
+
+import numpy as np
+
+from engine import TARGETS, PROFILE_DEFAULTS, topo_order, is_input, compile_calc, bind
+from params import params, STATUS_INDEX
+
+
+def tax_table_array(inval, table):
+    """tax_table() for an array of incomes: one searchsorted, one multiply.
+    table is a params.Params.brackets entry as arrays."""
+    cuts, rate, base = table
+    x = np.asarray(inval, dtype=float)
+    i = np.maximum(np.searchsorted(cuts, x, side="right") - 1, 0)
+    return np.where(x < cuts[0], 0., base[i] + (x - cuts[i])*rate[i])
+
+
+def tax_calc_array(inval, table):
+    """tax_calc(), including the $50-table midpoint below $100k."""
+    x = np.asarray(inval, dtype=float)
+    out = tax_table_array(np.where(x >= 100000, x, np.round(x/50)*50 + 25), table)
+    return np.where(x == 0, 0., out)
+
+
+def _vmax(*args):
+    return reduce(np.maximum, args)
+
+def _vmin(*args):
+    return reduce(np.minimum, args)
+
+def _vwhere(cond, a, b):
+    if np.ndim(cond) == 0:
+        return a if cond else b
+    return np.where(cond, a, b)
+
+
+class _Elementwise(ast.NodeTransformer):
+    """max/min -> _vmax/_vmin, (a if c else b) -> _vwhere(c, a, b)."""
+    def visit_Name(self, node):
+        if node.id == "max": node.id = "_vmax"
+        elif node.id == "min": node.id = "_vmin"
+        return node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return ast.copy_location(ast.Call(func=ast.Name(id="_vwhere", ctx=ast.Load()),
+                                          args=[node.test, node.body, node.orelse],
+                                          keywords=[]), node)
+
+
+def _lift(fn):
+    """Call a scalar helper directly on scalars, row by row on arrays."""
+    vec = np.vectorize(fn, otypes=[float])
+    def lifted(*args):
+        if all(np.ndim(a) == 0 for a in args):
+            return fn(*args)
+        return vec(*args)
+    return lifted
+
+
+def _names_used(code, ns, seen):
+    """Global names a code object reads, following calls into ns's functions."""
+    for n in code.co_names:
+        if n in seen: continue
+        seen.add(n)
+        f = ns.get(n)
+        if isinstance(f, types.FunctionType):
+            _names_used(f.__code__, ns, seen)
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            _names_used(c, ns, seen)
+    return seen
+
+
+class BatchEngine():
+    def __init__(self, cell_list, deps, ns, targets=TARGETS):
+        self.cell_list = cell_list
+        self.ns = ns
+        self.targets = tuple(targets)
+        self.order = topo_order(deps, self.targets, cell_list)
+        self.names = list(cell_list.keys())
+        self.slots = {name: i for i, name in enumerate(self.names)}
+        self.inputs = [(name, self.slots[name]) for name in self.order
+                       if is_input(cell_list[name])]
+
+        base = bind(ns, dict(_vmax=_vmax, _vmin=_vmin, _vwhere=_vwhere))
+        self.plan = [(name, self.slots[name],
+                      compile_calc(name, cell_list[name].calc, self.slots, base,
+                                   _Elementwise()).__code__)
+                     for name in self.order if not is_input(cell_list[name])]
+        self.base = base
+
+        used = set()
+        for _, _, code in self.plan:
+            _names_used(code, ns, used)
+        # Only the answers the graph actually reads split the batch into groups.
+        self.profile_keys = sorted(k for k in PROFILE_DEFAULTS if k in used)
+        self.helpers = [k for k in used if isinstance(ns.get(k), types.FunctionType)]
+        self.tax_tables = dict()
+
+    def _group_ns(self, profile):
+        gns = bind(self.base, profile)
+        for k in self.helpers:
+            gns[k] = _lift(gns[k])
+        status = gns["fstatus"]()
+        def table(year):
+            key = (year or gns["tax_year"], status)
+            if key not in self.tax_tables:
+                self.tax_tables[key] = tuple(np.array(c, dtype=float)
+                                             for c in params(key[0]).brackets[STATUS_INDEX[status]])
+            return self.tax_tables[key]
+        gns["tax_calc"] = lambda inval, year=None: tax_calc_array(inval, table(year))
+        return gns
+
+    def compute(self, inputs, profiles=None, outputs=None):
+        """inputs: input cell name -> column (missing cells are zero).
+        profiles: interview answer -> column or scalar (missing ones default
+        as in interview_template.py). Returns output cell name -> array."""
+        if profiles is None: profiles = dict()
+        if outputs is None: outputs = self.targets
+        cols = dict((k, np.asarray(v)) for k, v in inputs.items())
+        n = max([len(c) for c in cols.values()] + [np.size(v) for v in profiles.values()] + [0])
+
+        keys = self.profile_keys
+        pcols = [np.broadcast_to(np.asarray(profiles.get(k, PROFILE_DEFAULTS[k])), (n,)).tolist()
+                 for k in keys]
+        groups = dict()
+        for row, key in enumerate(zip(*pcols)):
+            groups.setdefault(key, []).append(row)
+
+        out = dict((name, np.zeros(n)) for name in outputs)
+        v = [0.] * len(self.names)
+        with np.errstate(all="ignore"):
+            for key, rows in groups.items():
+                rows = np.array(rows)
+                gns = self._group_ns(dict(zip(keys, key)))
+                for name, i in self.inputs:
+                    v[i] = cols[name][rows].astype(float) if name in cols else 0.
+                for _, i, code in self.plan:
+                    v[i] = types.FunctionType(code, gns)(v)
+                for name in outputs:
+                    out[name][rows] = v[self.slots[name]]
+        return out
+
+    def compare_years(self, inputs, years, profiles=None, outputs=None):
+        """The same returns figured under each tax year, e.g. this year and
+        last: year -> what compute() returns."""
+        if profiles is None: profiles = dict()
+        return dict((year, self.compute(inputs, dict(profiles, tax_year=year), outputs))
+                    for year in years)
@@ -0,0 +1,256 @@
+"""Time the engine, so a change to cells.py or taxforms.py that slows it shows up.
+
+The returns come from a seeded generator: the same seed always gives the same
+households, and the first 256 of them run through every filing status crossed
+with every schedule the interview can switch on (itemizing, student loans,
+capital gains, rentals, self-employment, kids). Amounts are drawn from rough
+but plausible distributions: lognormal wages, withholding near the effective
+rate, Schedule C expenses a share of receipts, and so on.
+
+Benchmarks:
+  cells        one return through cell_list['f1040_refund'].compute(), the
+               path taxes.py used to take
+  full         Engine.compute() of every cell for one return
+  incremental  Engine.set_input() on one input, then recompute()
+  summary      Engine.summary() over n returns, as /calculate_batch does
+  batch        BatchEngine.compute() over n returns in NumPy columns
+
+From the command line: python taxes.py bench [--sizes 1000,10000] [-o bench.ndjson]
+Each run appends one JSON line (engine version, machine, every result) to the
+output file, so runs can be compared over time.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+from datetime import datetime
+from time import perf_counter
+
+from codegen import CACHE_DIR as CODEGEN_DIR
+from engine import load, profile_from, PROFILE_DEFAULTS, HERE
+
+STATUSES = ("single", "married filing jointly", "married filing separately", "head of household")
+SCHEDULES = ("itemizing", "s_loans", "cap_gains", "have_rr", "self_emp", "kids")
+PROFILES = [(status,) + switches for status in STATUSES
+            for switches in itertools.product((False, True), repeat=len(SCHEDULES))]
+
+SIZES = (1000, 10000, 100000)
+
+
+def _money(x):
+    return float(max(0, round(x)))
+
+
+def household(rng, combo):
+    """One (interview, inform) pair for a PROFILES entry. A single filer with
+    kids files as head of household, as profile_from() decides."""
+    status, itemizing, s_loans, cap_gains, have_rr, self_emp, kids = combo
+    joint = status == "married filing jointly"
+    over_65 = rng.random() < 0.2
+    interview = dict(status=status, itemizing=itemizing, s_loans=s_loans, cap_gains=cap_gains,
+                     have_rr=have_rr, self_emp=self_emp,
+                     kids=rng.randint(1, 3) if kids else 0,
+                     dependents=1 if rng.random() < 0.1 else 0,
+                     over_65=over_65, spouse_over_65=joint and over_65 and rng.random() < 0.8)
+
+    wages = _money(rng.lognormvariate(10.9, 0.7) * (1.6 if joint else 1))
+    inform = dict(f1040_wages=wages,
+                  f1040_federal_tax_withheld=_money(wages * rng.uniform(0.06, 0.18)),
+                  f1040_interest=_money(rng.expovariate(1/300)),
+                  f1040_dividends=_money(rng.expovariate(1/800)))
+    if over_65:
+        inform["f1040_taxable_ss_benefits"] = _money(rng.uniform(8000, 30000))
+        inform["f1040_pensions"] = _money(rng.expovariate(1/15000))
+    if cap_gains:
+        inform["f1040_capital_gains"] = _money(rng.expovariate(1/12000))
+        inform["f1040_qualified_dividends"] = _money(inform["f1040_dividends"] * rng.uniform(0.5, 1))
+    if itemizing:
+        inform.update(f1040_sched_a_reported_mort_interest=_money(rng.uniform(2000, 25000)),
+                      f1040_sched_a_real_estate_taxes=_money(rng.uniform(1500, 12000)),
+                      f1040_sched_a_local_taxes=_money(wages * rng.uniform(0.02, 0.07)),
+                      f1040_sched_a_charity_cash=_money(rng.expovariate(1/2500)),
+                      f1040_sched_a_medical_expenses=_money(rng.expovariate(1/4000)))
+    if s_loans:
+        inform.update(student_loan_ws_1040_student_loan_interest=_money(rng.uniform(300, 2500)),
+                      f8863_education_expenses_1=_money(rng.uniform(0, 6000)))
+    if have_rr:
+        rents = _money(rng.uniform(9000, 40000))
+        inform.update(f1040_sched_e_rents_received=rents,
+                      f1040_sched_e_rental_mortgage_interest=_money(rents * rng.uniform(0.2, 0.5)),
+                      f1040_sched_e_rental_taxes=_money(rents * rng.uniform(0.05, 0.15)),
+                      f1040_sched_e_rental_repairs_supplies=_money(rents * rng.uniform(0, 0.2)),
+                      f4562_rental_property_value=_money(rents * rng.uniform(10, 20)))
+    if self_emp:
+        receipts = _money(rng.lognormvariate(10.5, 0.9))
+        inform.update(f1040_sched_c_gross_rcpts=receipts,
+                      f1040_sched_c_expenses=_money(receipts * rng.uniform(0.2, 0.7)),
+                      f1040_sched_c_home_expenses=_money(rng.uniform(0, 3000)),
+                      sched_se_ss_wages=wages)
+    if kids:
+        inform["ctc_sch8812_IIA_ss_and_medicare_withheld"] = _money(wages * 0.0765)
+    if rng.random() < 0.3:
+        inform["f1040sch1_ira_deduction"] = _money(rng.uniform(500, 6500))
+    if rng.random() < 0.15:
+        inform["f1040sch1_hsa_deduction"] = _money(rng.uniform(500, 7000))
+    return interview, inform
+
+
+def households(n, seed=0):
+    """n synthetic returns; every profile in PROFILES once in each run of
+    len(PROFILES), the order shuffled after the first."""
+    rng = random.Random(seed)
+    order = list(range(len(PROFILES)))
+    for i in range(n):
+        if i and i % len(order) == 0: rng.shuffle(order)
+        yield household(rng, PROFILES[order[i % len(order)]])
+
+
+def _latency(name, times, **extra):
+    times = sorted(times)
+    return dict(bench=name, n=len(times), mean_us=statistics.fmean(times) * 1e6,
+                p50_us=times[len(times)//2] * 1e6, p95_us=times[int(len(times)*.95)] * 1e6,
+                **extra)
+
+
+def _throughput(name, n, seconds, **extra):
+    return dict(bench=name, n=n, seconds=seconds, per_second=n / seconds, **extra)
+
+
+def bench_cells(returns):
+    """cell_list['f1040_refund'].compute() with the cells.py globals bound to
+    each return, every done flag cleared first (outside the timing)."""
+    ns = dict(PROFILE_DEFAULTS, debug=False)
+    for path in ("cells.py", "taxforms.py"):
+        with open(os.path.join(HERE, path)) as f:
+            exec(compile(f.read(), path, "exec"), ns)
+    cells = ns["cell_list"]
+    inputs = [name for name, c in cells.items() if "u" in c.flag]
+    for name in inputs:
+        cells[name].calc = name   # As setup_inform() does
+    zeros = dict.fromkeys(inputs, 0)
+    refund = cells["f1040_refund"]
+    times = []
+    for interview, inform in returns:
+        ns.update(profile_from(interview))
+        ns.update(zeros)
+        ns.update(inform)
+        for c in cells.values():
+            c.done = False
+        start = perf_counter()
+        refund.compute()
+        times.append(perf_counter() - start)
+    return _latency("cells", times)
+
+
+def bench_full(engine, returns):
+    state = engine.new_state()
+    times = []
+    for interview, inform in returns:
+        engine.ns.update(profile_from(interview))
+        start = perf_counter()
+        engine.compute(inform, state)
+        times.append(perf_counter() - start)
+    return _latency("full", times, cells=len(engine.plan))
+
+
+def bench_incremental(engine, returns, names=("f1040_wages", "f1040sch1_ira_deduction")):
+    """What-if edits: one input up by $1000, then recompute what it feeds."""
+    state = engine.new_state()
+    times = []
+    redone = 0
+    for k, (interview, inform) in enumerate(returns):
+        engine.ns.update(profile_from(interview))
+        engine.compute(inform, state)
+        name = names[k % len(names)]
+        start = perf_counter()
+        engine.set_input(name, inform.get(name, 0) + 1000, state)
+        redone += engine.recompute(state)
+        times.append(perf_counter() - start)
+    return _latency("incremental", times, cells_per_edit=redone / len(times))
+
+
+def bench_summary(engine, returns):
+    """Straight-line code per profile, generated (or read from the disk cache)
+    for every profile in the batch before the clock starts."""
+    returns = list(returns)
+    first = dict()
+    for interview, inform in returns:
+        first.setdefault(engine.profile_key(profile_from(interview)), (interview, inform))
+    for interview, inform in first.values():
+        engine.summary(interview, inform)
+    start = perf_counter()
+    for interview, inform in returns:
+        engine.summary(interview, inform)
+    return _throughput("summary", len(returns), perf_counter() - start, profiles=len(first))
+
+
+def bench_batch(batch, returns):
+    """BatchEngine.compute() over n returns, counting the conversion of the
+    answers to columns."""
+    returns = list(returns)
+    start = perf_counter()
+    names = set(k for _, inform in returns for k in inform)
+    cols = dict((k, [inform.get(k, 0.) for _, inform in returns]) for k in names)
+    profiles = [profile_from(interview) for interview, _ in returns]
+    prof = dict((k, [p[k] for p in profiles]) for k in batch.profile_keys)
+    batch.compute(cols, prof)
+    return _throughput("batch", len(returns), perf_counter() - start)
+
+
+def run(seed=0, samples=2000, sizes=SIZES, scalar_limit=None):
+    """Every benchmark; a list of result dicts. summary skips sizes above
+    scalar_limit, if given."""
+    engine = load(codegen_dir=CODEGEN_DIR)
+    sample = list(households(samples, seed))
+    engine.summary(*sample[0])   # Generate and load the code before timing it
+    results = [bench_cells(sample), bench_full(engine, sample), bench_incremental(engine, sample)]
+    try:
+        from batch import BatchEngine
+    except ImportError:   # No NumPy
+        BatchEngine = None
+    if BatchEngine is not None:
+        batch = BatchEngine(engine.cell_list, engine.deps, engine.ns)
+    for n in sizes:
+        returns = list(households(n, seed))
+        if scalar_limit is None or n <= scalar_limit:
+            results.append(bench_summary(engine, returns))
+        if BatchEngine is not None:
+            results.append(bench_batch(batch, returns))
+    return engine, results
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="taxes.py bench",
+                                     description="Time the engine on synthetic returns.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=2000, help="returns for the latency benchmarks")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)),
+                        help="comma-separated batch sizes for the throughput benchmarks")
+    parser.add_argument("--scalar-limit", type=int, default=None,
+                        help="skip Engine.summary() throughput above this many returns")
+    parser.add_argument("-o", "--out", default="bench.ndjson", help="file to append the run to; - for stdout")
+    opts = parser.parse_args(args)
+
+    sizes = [int(s) for s in opts.sizes.split(",") if s]
+    engine, results = run(opts.seed, opts.samples, sizes, opts.scalar_limit)
+    for r in results:
+        if "per_second" in r:
+            print("%-12s %7d returns  %9.3f s  %10.0f returns/s" % (r["bench"], r["n"], r["seconds"], r["per_second"]))
+        else:
+            print("%-12s %7d returns  p50 %8.1f us  p95 %8.1f us" % (r["bench"], r["n"], r["p50_us"], r["p95_us"]))
+
+    record = dict(time=datetime.now().isoformat(timespec="seconds"), version=engine.version,
+                  seed=opts.seed, python=platform.python_version(), machine=platform.machine(),
+                  cpus=os.cpu_count(), results=results)
+    out = sys.stdout if opts.out == "-" else open(opts.out, "a")
+    out.write(json.dumps(record) + "\n")
+    out.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
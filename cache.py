@@ -0,0 +1,74 @@
+"""Remember recent results, keyed by what went into them.
+
+The key is a hash of the normalized interview profile, every nonzero input
+value and the engine's version (a hash of cells.py, taxforms.py and
+params.py), so a reload with new form definitions or tax tables can never be
+served an old answer. The cache
+holds at most `maxsize` results and drops the least recently used.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from engine import profile_from
+
+
+def _canonical(v):
+    if isinstance(v, (bool, int, float)): return float(v)
+    return v
+
+
+class ResultCache():
+    def __init__(self, engine, maxsize=4096, timer=None):
+        """timer, if given, is a metrics.Histogram that times each engine call."""
+        self.engine = engine
+        self.maxsize = maxsize
+        self.timer = timer
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, profile, inputs):
+        # Unset and zero inputs mean the same thing to the engine, as do 100 and 100.0.
+        inputs = dict((k, _canonical(v)) for k, v in inputs.items() if v)
+        blob = json.dumps([self.engine.version, profile, inputs], sort_keys=True,
+                          separators=(",", ":"), default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def summary(self, interview, inform):
+        """Engine.summary(), answered from the cache when the same return was
+        seen recently."""
+        key = self.key(profile_from(interview), inform)
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return dict(self.data[key])
+            self.misses += 1
+        if self.timer is None:
+            result = self.engine.summary(interview, inform)
+        else:
+            with self.timer.time():
+                result = self.engine.summary(interview, inform)
+        with self.lock:
+            self.data[key] = result
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return dict(result)
+
+    def invalidate(self, engine=None):
+        """Forget everything, e.g. after the form definitions change.
+        Pass the newly loaded engine to switch to it."""
+        with self.lock:
+            if engine is not None: self.engine = engine
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(size=len(self.data), maxsize=self.maxsize, hits=self.hits,
+                        misses=self.misses, hit_ratio=self.hits/lookups if lookups else 0.)
@@ -1,4 +1,11 @@
+from time import perf_counter_ns
+
+deps_verified = False   # formc.py's taxforms.py sets this once deps match the calcs
+trace = None            # a tracing.Trace to record what compute() does
+
 class cell():
+    __slots__ = ("text", "line", "name", "calc", "done", "value", "flag", "situation", "form")
+
     def __init__(self, text, line, calc='0', flag='c', situation=True, name='x', form='1040'):
         self.text=text
         self.line=line
@@ -23,9 +30,8 @@ class cell():
         return True
 
     def compute(self):
-        if debug: print ("Checking "+self.name, flush=True)
         if self.done:
-            if debug: print ("  Got "+str(self.value), flush=True)
+            if trace is not None: trace.hit(self.name)
             return self.value
 
         parents = deps[self.name]
@@ -33,12 +39,19 @@ class cell():
             for i in parents:
                 if (i==""): continue
                 cell_list[i].compute()
-            for i in parents:
-                if (i==""): continue
-                if (not cell_list[i].check_done()):
-                    print("Missing dependency for\t", self.name, "; need", cell_list[i].name)
-                    return False
-        if debug: print ("Computing\t" + self.name + ":\t" +self.calc, flush=True)
-        self.value = eval(self.calc)
-        if debug: print ("  For ", self.name, " got:\t", str(self.value), flush=True)
+            if not deps_verified:
+                for i in parents:
+                    if (i==""): continue
+                    if (not cell_list[i].check_done()):
+                        print("Missing dependency for\t", self.name, "; need", cell_list[i].name)
+                        return False
+        if trace is None:
+            self.value = eval(self.calc)
+        else:
+            start = perf_counter_ns()
+            self.value = eval(self.calc)
+            trace.cell(self.name, start, perf_counter_ns())
         self.done=True
+
+def Cv(label):
+    return cell_list[label].value
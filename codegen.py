@@ -0,0 +1,174 @@
+"""Turn a profile's plan into one straight-line Python function.
+
+A Plan still runs each cell as its own lambda over the value list. Here the
+plan is written out as source instead: every live cell becomes a local
+variable assigned in topological order, Cv('x') becomes the local x, and cells
+the profile folds to constants become literals. The result is compiled once
+and kept on disk as marshalled bytecode, keyed by the engine's version (a
+hash of cells.py, taxforms.py and params.py), engine.py, the profile and the
+Python version, so a warm start loads it without generating anything.
+
+The .py source is written next to the bytecode for reading; it is never
+imported.
+"""
+
+import ast
+import hashlib
+import marshal
+import math
+import os
+import sys
+import threading
+
+from engine import GraphError, HERE, bind
+
+CACHE_DIR = os.path.join(HERE, "__pycache__", "taxgraph")
+FORMAT = 1   # Bump when generate_source() changes what it writes
+
+
+class _CvToName(ast.NodeTransformer):
+    def __init__(self, name, local, constants):
+        self.name = name
+        self.local = local
+        self.constants = constants
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        f = node.func
+        if not (isinstance(f, ast.Name) and f.id == "Cv"):
+            return node
+        if len(node.args) != 1 or not isinstance(node.args[0], ast.Constant):
+            raise GraphError("%s: Cv() needs a literal cell name" % (self.name,))
+        label = node.args[0].value
+        if label in self.local:
+            return ast.copy_location(ast.Name(id=label, ctx=ast.Load()), node)
+        if label in self.constants:
+            return ast.copy_location(_literal(label, self.constants[label]), node)
+        raise GraphError("Missing dependency for %s: %s" % (self.name, label))
+
+
+class _FoldProfile(ast.NodeTransformer):
+    """Replace the interview answers, and fstatus(), with this profile's
+    values, then settle the comparisons and IFs that leaves constant: the
+    Fswitch chains on filing status collapse to the one branch that applies."""
+    def __init__(self, profile):
+        self.profile = profile
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load) and node.id in self.profile:
+            return ast.copy_location(ast.Constant(value=self.profile[node.id]), node)
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id == "fstatus" and not node.args:
+            return ast.copy_location(ast.Constant(value=self.profile["status"]), node)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if all(isinstance(n, ast.Constant) for n in [node.left] + node.comparators):
+            return ast.copy_location(ast.Constant(value=eval(compile(
+                ast.fix_missing_locations(ast.Expression(node)), "<fold>", "eval"))), node)
+        return node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.test, ast.Constant):
+            return node.body if node.test.value else node.orelse
+        return node
+
+
+def _literal(name, value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return ast.parse("float(%r)" % (repr(value),), mode="eval").body
+    node = ast.parse(repr(value), mode="eval").body
+    try:
+        ast.literal_eval(node)
+    except ValueError:
+        raise GraphError("%s: can't write %r as a literal" % (name, value))
+    return node
+
+
+def generate_source(engine, profile, prune=True):
+    """Python source for a module whose evaluate(inputs) returns the target
+    values, as engine.plan_for(profile, prune).evaluate() would."""
+    plan = engine.plan_for(profile, prune)
+    names = engine.names
+    steps = set(i for i, _ in plan.steps)
+    local = set(name for name, _ in plan.inputs) | set(names[i] for i in steps)
+    constants = dict((name, plan.constants[i]) for i, name in enumerate(names)
+                     if name not in local)
+
+    lines = ["# Generated by codegen.py from engine version %s. Do not edit." % (engine.version,),
+             "PROFILE = %r" % (sorted(profile.items()),),
+             "PRUNED = %r" % (tuple(plan.pruned),),
+             "TARGETS = %r" % (engine.targets,),
+             "",
+             "def evaluate(inputs):",
+             "    get = inputs.get"]
+    for name, _ in plan.inputs:
+        lines.append("    %s = get(%r, 0)" % (name, name))
+    for name in engine.order:
+        if engine.slots[name] not in steps: continue
+        calc = engine.cell_list[name].calc
+        expr = _CvToName(name, local, constants).visit(ast.parse(calc.strip() or "0", mode="eval").body)
+        expr = _FoldProfile(profile).visit(expr)
+        lines.append("    %s = %s" % (name, ast.unparse(ast.fix_missing_locations(expr))))
+    returned = [t if t in local else ast.unparse(_literal(t, constants[t])) for t in engine.targets]
+    lines.append("    return (%s,)" % (", ".join(returned),))
+    return "\n".join(lines) + "\n"
+
+
+with open(os.path.join(HERE, "engine.py"), "rb") as f:
+    COMPILER = hashlib.sha256(f.read()).hexdigest()[:16]   # The plans generated here come from engine.py
+
+
+def cache_key(engine, profile, prune=True):
+    if engine.version is None:
+        raise GraphError("Generated code is keyed by engine.version; build the engine with load()")
+    blob = repr((FORMAT, engine.version, COMPILER, sys.implementation.cache_tag, engine.targets,
+                 sorted(profile.items()), prune))
+    return hashlib.sha256(blob.encode()).hexdigest()[:20]
+
+
+def _write(path, data):
+    # Write then rename, so a concurrent reader sees the old file or the whole new one.
+    # The name is per process and thread: sync endpoints run in a thread pool.
+    tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class Generated():
+    """The compiled function for one profile, from the disk cache if it's there."""
+    def __init__(self, engine, profile, prune=True, cache_dir=CACHE_DIR):
+        key = cache_key(engine, profile, prune)
+        path = os.path.join(cache_dir, key)
+        code = None
+        try:
+            with open(path + ".bin", "rb") as f:
+                code = marshal.load(f)
+            self.from_cache = True
+        except (OSError, EOFError, ValueError, TypeError):
+            src = generate_source(engine, profile, prune)
+            code = compile(src, path + ".py", "exec")
+            self.from_cache = False
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                _write(path + ".py", src.encode())
+                _write(path + ".bin", marshal.dumps(code))
+            except OSError:
+                pass   # Read-only install: still fine, just not cached
+        ns = bind(engine.ns, profile)
+        exec(code, ns)
+        self.evaluate = ns["evaluate"]
+        self.pruned = frozenset(ns["PRUNED"])
+        self.targets = ns["TARGETS"]
+
+    def accepts(self, inputs):
+        """False if the caller gave a value to an input this profile dropped."""
+        for name in self.pruned.intersection(inputs):
+            if inputs[name]: return False
+        return True
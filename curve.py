@@ -0,0 +1,455 @@
+"""Refund and tax owed as exact piecewise-linear functions of one input.
+
+Instead of evaluating the return at thousands of values of, say, wages, the
+chosen input is set to the function x -> x on [low, high] and every cell
+downstream of it is evaluated once over Piecewise values: lists of
+breakpoints with a line (intercept, slope) between each pair. +, - and
+scaling act on the lines; max, min and comparisons split pieces where two
+lines cross; IF picks between its branches piece by piece; and tax_calc is
+composed with the bracket table, so the $50 rows below $100,000 come out as
+the steps they are. What reaches f1040_refund and f1040_tax_owed is the
+whole curve: its breakpoints and the slope of every piece.
+
+Pieces are closed on the left: at a jump the curve takes the value to the
+right of it. (At a jump itself the return may land on either side; the tax
+table rounds a half to even.)
+
+A cell that can't be carried through this way (a helper that branches with
+`if`, the product of two inputs, ...) is sampled instead: its calc is run as
+array arithmetic, as batch.py does, over a dense grid of the input plus its
+parents' breakpoints, and the samples are joined back into pieces, with a
+kink between two grid points put where the lines on either side meet, and
+the grid filled in around each jump until it is pinned down. Each such cell
+is good to about `tol` dollars; curve() says which were sampled and which
+outputs they reach.
+
+From the command line: python taxes.py curve --input f1040_wages [--low 0 --high 500000]
+reads interview.py and inform.py like taxes.py does.
+"""
+
+import argparse
+import ast
+import json
+import sys
+import types
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from engine import GraphError, bind, compile_calc, load, read_answers, profile_from
+from params import params, STATUS_INDEX
+
+OUTPUTS = ("f1040_refund", "f1040_tax_owed")
+JUMP = 0.01   # a sampled jump is located to within this much of the input
+
+
+class NotLinear(Exception):
+    """Raised where a Piecewise value would stop being piecewise linear."""
+
+
+class Piecewise():
+    """f(x) = a[k] + b[k]*x for xs[k] <= x < xs[k+1]; the last piece also
+    covers xs[-1]."""
+    __slots__ = ("xs", "a", "b")
+
+    def __init__(self, xs, a, b):
+        self.xs = xs
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def line(cls, lo, hi, a=0., b=1.):
+        return cls([lo, hi], [a], [b])
+
+    def __call__(self, x):
+        """The value at x, a number or an array."""
+        if np.ndim(x):
+            k = np.clip(np.searchsorted(self.xs, x, side="right") - 1, 0, len(self.a) - 1)
+            return np.take(self.a, k) + np.take(self.b, k)*x
+        k = min(max(bisect_right(self.xs, x) - 1, 0), len(self.a) - 1)
+        return self.a[k] + self.b[k]*x
+
+    def breakpoints(self):
+        return self.xs[1:-1]
+
+    def pieces(self):
+        """(start, end, value at start, slope) for each piece."""
+        return [(x0, x1, a + b*x0, b) for x0, x1, a, b in zip(self.xs, self.xs[1:], self.a, self.b)]
+
+    def simplified(self):
+        """Neighbouring pieces on the same line joined into one."""
+        xs, a, b = [self.xs[0]], [], []
+        for x1, pa, pb in zip(self.xs[1:], self.a, self.b):
+            if a and abs(pb - b[-1]) <= 1e-9 and abs(pa - a[-1] + (pb - b[-1])*xs[-1]) <= 1e-9*(1 + abs(pa)):
+                xs[-1] = x1
+                continue
+            xs.append(x1)
+            a.append(pa)
+            b.append(pb)
+        return Piecewise(xs, a, b)
+
+    def _like(self, c):
+        if isinstance(c, Piecewise): return c
+        return Piecewise.line(self.xs[0], self.xs[-1], float(c), 0.)
+
+    def _combine(self, other, line, cross=False):
+        """Apply line(fa, fb, ga, gb, x) -> (a, b) over the common pieces of
+        self and other, splitting first where their lines cross if asked."""
+        g = self._like(other)
+        xs, a, b = [self.xs[0]], [], []
+        for x0, x1, fa, fb, ga, gb in _align(self, g):
+            cuts = [x0, x1]
+            if cross and fb != gb:
+                r = (ga - fa)/(fb - gb)
+                if x0 < r < x1: cuts = [x0, r, x1]
+            for p, q in zip(cuts, cuts[1:]):
+                pa, pb = line(fa, fb, ga, gb, (p + q)/2)
+                xs.append(q)
+                a.append(pa)
+                b.append(pb)
+        return Piecewise(xs, a, b).simplified()
+
+    def __add__(self, other):
+        if not isinstance(other, Piecewise):
+            return Piecewise(self.xs, [a + other for a in self.a], self.b)
+        return self._combine(other, lambda fa, fb, ga, gb, x: (fa + ga, fb + gb))
+    __radd__ = __add__
+
+    def __neg__(self):
+        return Piecewise(self.xs, [-a for a in self.a], [-b for b in self.b])
+
+    def __pos__(self):
+        return self
+
+    def __sub__(self, other):
+        return self + -other
+
+    def __rsub__(self, other):
+        return -self + other
+
+    def __mul__(self, other):
+        if not isinstance(other, Piecewise):
+            if other == 0: return Piecewise.line(self.xs[0], self.xs[-1], 0., 0.)
+            return Piecewise(self.xs, [a*other for a in self.a], [b*other for b in self.b])
+        def line(fa, fb, ga, gb, x):
+            if fb and gb: raise NotLinear("product of two lines")
+            return fa*ga, fa*gb + fb*ga
+        return self._combine(other, line)
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if not isinstance(other, Piecewise): return self * (1./other)
+        def line(fa, fb, ga, gb, x):
+            if gb: raise NotLinear("division by a line")
+            return fa/ga, fb/ga
+        return self._combine(other, line)
+
+    def __rtruediv__(self, other):
+        return self._like(other) / self
+
+    def __abs__(self):
+        return _max(self, -self)
+
+    def _compare(self, other, test):
+        return self._combine(other, lambda fa, fb, ga, gb, x: (float(test(fa + fb*x, ga + gb*x)), 0.),
+                             cross=True)
+
+    def __lt__(self, other): return self._compare(other, lambda f, g: f < g)
+    def __le__(self, other): return self._compare(other, lambda f, g: f <= g)
+    def __gt__(self, other): return self._compare(other, lambda f, g: f > g)
+    def __ge__(self, other): return self._compare(other, lambda f, g: f >= g)
+
+    def __eq__(self, other):
+        return self._combine(other, lambda fa, fb, ga, gb, x: (float(fa == ga and fb == gb), 0.))
+
+    def __ne__(self, other):
+        return 1 - (self == other)
+
+    __hash__ = None
+
+    def __bool__(self):
+        raise NotLinear("a test on a Piecewise value")
+
+    def __round__(self, ndigits=None):
+        raise NotLinear("rounding")
+
+    def __pow__(self, other):
+        raise NotLinear("a power")
+
+    def __int__(self):
+        raise NotLinear("int()")
+    __float__ = __index__ = __trunc__ = __floor__ = __ceil__ = __int__
+
+    @classmethod
+    def from_samples(cls, x, y, tol=0.02, jump=0.):
+        """Pieces through sorted samples (x, y), as _runs() finds them. A run
+        that just bridges two others over less than `jump` is taken as a jump
+        at its right end."""
+        out = []
+        for run in _runs(x, y, tol):
+            if out and run[4] == 1 and run[1] - run[0] < jump:
+                out[-1][1] = run[1]
+                continue
+            out.append(run)
+        if not out: return cls.line(x[0], x[-1], float(y[0]), 0.)
+        return cls([out[0][0]] + [run[1] for run in out], [run[2] for run in out],
+                   [run[3] for run in out]).simplified()
+
+
+def _runs(x, y, tol):
+    """[start, end, a, b, segments] for each run of samples on one line to
+    within tol: the run grows while some line from its first sample passes
+    within tol of every sample in it. A run of one segment between two others
+    whose lines meet inside it is a bend between two samples, and is replaced
+    by that point."""
+    x, y = list(map(float, x)), list(map(float, y))
+    runs = []
+    s = 0
+    while s < len(x) - 1:
+        low, high = -float("inf"), float("inf")   # slopes that fit so far
+        e = s
+        while e + 1 < len(x):
+            dx = x[e+1] - x[s]
+            low2, high2 = max(low, (y[e+1] - y[s] - tol)/dx), min(high, (y[e+1] - y[s] + tol)/dx)
+            if low2 > high2: break
+            low, high = low2, high2
+            e += 1
+        b = min(max((y[e] - y[s])/(x[e] - x[s]), low), high)
+        runs.append([x[s], x[e], y[s] - b*x[s], b, e - s])
+        s = e
+
+    out = runs[:1]
+    for k in range(1, len(runs)):
+        run = runs[k]
+        if run[4] == 1 and k + 1 < len(runs) and out[-1][3] != runs[k+1][3]:
+            prev, after = out[-1], runs[k+1]
+            r = (after[2] - prev[2])/(prev[3] - after[3])
+            if run[0] <= r <= run[1]:
+                prev[1] = r
+                after[0] = r
+                continue
+        out.append(run)
+    return out
+
+
+def _align(f, g):
+    """(x0, x1, fa, fb, ga, gb) over the pieces of f and g cut at both sets of breakpoints."""
+    i = j = 0
+    x0 = f.xs[0]
+    while True:
+        x1 = min(f.xs[i+1], g.xs[j+1])
+        yield x0, x1, f.a[i], f.b[i], g.a[j], g.b[j]
+        if f.xs[i+1] == x1: i += 1
+        if g.xs[j+1] == x1: j += 1
+        if i == len(f.a) or j == len(g.a): return
+        x0 = x1
+
+
+def _pick(larger):
+    def line(fa, fb, ga, gb, x):
+        return (fa, fb) if (fa + fb*x > ga + gb*x) == larger else (ga, gb)
+    return line
+
+def _extreme(builtin, line):
+    def extreme(*args):
+        if len(args) == 1: args = tuple(args[0])
+        if not any(isinstance(a, Piecewise) for a in args): return builtin(*args)
+        out = next(a for a in args if isinstance(a, Piecewise))
+        for a in args:
+            if a is not out: out = out._combine(a, line, cross=True)
+        return out
+    return extreme
+
+_max = _extreme(max, _pick(True))
+_min = _extreme(min, _pick(False))
+
+
+def _where(test, a, b):
+    """The calcs' (a if test else b), with each branch a thunk."""
+    if not isinstance(test, Piecewise): return a() if test else b()
+    return test*a() + (1 - test)*b()
+
+
+def compose(f, knots, scalar, slope):
+    """scalar(f(x)) for a scalar function that is linear, with the given
+    slope, between each pair of sorted knots."""
+    xs, a, b = [f.xs[0]], [], []
+    for x0, x1, fa, fb in zip(f.xs, f.xs[1:], f.a, f.b):
+        if fb == 0:
+            xs.append(x1)
+            a.append(scalar(fa))
+            b.append(0.)
+            continue
+        u0, u1 = sorted((fa + fb*x0, fa + fb*x1))
+        ts = [(t - fa)/fb for t in knots[bisect_right(knots, u0):bisect_left(knots, u1)]]
+        if fb < 0: ts.reverse()
+        cuts = [x0] + ts + [x1]
+        for p, q in zip(cuts, cuts[1:]):
+            if q <= p: continue
+            u = fa + fb*(p + q)/2
+            s = slope(u)
+            c = scalar(u) - s*u
+            xs.append(q)
+            a.append(c + s*fa)
+            b.append(s*fb)
+    return Piecewise(xs, a, b).simplified()
+
+
+class _Branches(ast.NodeTransformer):
+    """(a if c else b) -> _where(c, lambda: a, lambda: b)."""
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        thunk = lambda body: ast.Lambda(args=ast.arguments(posonlyargs=[], args=[], kwonlyargs=[],
+                                                           kw_defaults=[], defaults=[]), body=body)
+        return ast.copy_location(ast.Call(func=ast.Name(id="_where", ctx=ast.Load()),
+                                          args=[node.test, thunk(node.body), thunk(node.orelse)],
+                                          keywords=[]), node)
+
+
+def _tax_knots(cuts):
+    """Where tax_calc() changes line: the edges of the $50 table rows, $100,000,
+    and the bracket floors above it."""
+    return [50.*k + 25 for k in range(-1, 2000)] + [100000.] + [float(c) for c in cuts if c > 100000]
+
+
+class Curves():
+    """The calcs compiled once for Piecewise values; curve() per return."""
+    def __init__(self, engine, samples=2001, tol=0.02):
+        self.engine = engine
+        self.samples = samples
+        self.tol = tol
+        self.codes = dict((i, compile_calc(name, engine.cell_list[name].calc, engine.slots, {},
+                                           _Branches()).__code__)
+                          for name, i, _ in engine.plan)
+        self.batch = None   # (BatchEngine, its calcs by slot), built the first time a cell is sampled
+
+    def _namespace(self, profile):
+        ns = bind(self.engine.ns, profile)
+        scalar_calc, scalar_table = ns["tax_calc"], ns["tax_table"]
+        def brackets(year):
+            return params(year or ns["tax_year"]).brackets[STATUS_INDEX[ns["fstatus"]()]]
+        def rate_at(cuts, rate, u):
+            return rate[bisect_right(cuts, u) - 1] if u >= cuts[0] else 0.
+
+        def tax_table(inval, year=None):
+            if not isinstance(inval, Piecewise): return scalar_table(inval, year)
+            cuts, rate, base = brackets(year)
+            return compose(inval, [float(c) for c in cuts], lambda u: scalar_table(u, year),
+                           lambda u: rate_at(cuts, rate, u))
+
+        def tax_calc(inval, year=None):
+            if not isinstance(inval, Piecewise): return scalar_calc(inval, year)
+            cuts, rate, base = brackets(year)
+            return compose(inval, _tax_knots(cuts), lambda u: scalar_calc(u, year),
+                           lambda u: rate_at(cuts, rate, u) if u >= 100000 else 0.)
+
+        ns.update(max=_max, min=_min, _where=_where, tax_calc=tax_calc, tax_table=tax_table)
+        return ns
+
+    def _batch_ns(self, profile):
+        """batch.py's array namespace for the profile, and its calcs by slot."""
+        if self.batch is None:
+            from batch import BatchEngine
+            engine = self.engine
+            batch = BatchEngine(engine.cell_list, engine.deps, engine.ns, engine.targets)
+            # One assignment, so a concurrent curve() sees both or neither.
+            self.batch = batch, dict((i, code) for _, i, code in batch.plan)
+        batch, codes = self.batch
+        return batch._group_ns(profile), codes
+
+    def _sample(self, i, v, arrays, lo, hi):
+        """Cell i over a dense grid of the input, run as arrays, joined into
+        pieces. Where the samples jump, the grid is filled in until the jump
+        is pinned down to under a cent of the input."""
+        gns, codes = arrays
+        parents = [p for p in self.engine.graph.parents[i] if isinstance(v[p], Piecewise)]
+        w = list(v)
+        def at(x):
+            for p in parents:
+                w[p] = v[p](x)
+            with np.errstate(all="ignore"):
+                y = types.FunctionType(codes[i], gns)(w)
+            return np.broadcast_to(np.asarray(y, dtype=float), x.shape)
+
+        x = [np.linspace(lo, hi, self.samples)]
+        for p in parents:
+            bp = np.array(v[p].breakpoints())
+            x += [bp, bp - 1e-6]   # Both sides of any jump
+        x = np.unique(np.clip(np.concatenate(x), lo, hi))
+        y = at(x)
+        for _ in range(6):
+            wide = [(r[0], r[1]) for r in _runs(x, y, self.tol) if r[4] == 1 and r[1] - r[0] >= JUMP]
+            if not wide: break
+            more = np.concatenate([np.linspace(a, b, 18)[1:-1] for a, b in wide])
+            x, y = np.concatenate([x, more]), np.concatenate([y, at(more)])
+            order = np.argsort(x, kind="stable")
+            x, y = x[order], y[order]
+        return Piecewise.from_samples(x, y, self.tol, JUMP)
+
+    def curve(self, profile, inputs, name, lo=0., hi=500000., outputs=OUTPUTS):
+        """Each output as a function of input `name` over [lo, hi], the other
+        inputs as given: its pieces, its breakpoints, and whether it is exact
+        (nothing above it was sampled)."""
+        if not lo < hi: raise ValueError("The low end (%g) must be below the high end (%g)" % (lo, hi))
+        engine = self.engine
+        plan = engine.plan_for(profile, prune=False)   # every input stays live
+        slots = dict(plan.inputs)
+        if name not in slots: raise GraphError("%s is not an input cell" % (name,))
+        for out in outputs:
+            if out not in engine.slots: raise GraphError("No cell named %s" % (out,))
+
+        v = plan.evaluate(inputs)
+        v[slots[name]] = Piecewise.line(float(lo), float(hi))
+        ns = self._namespace(profile)
+        arrays = None
+        sampled, inexact = [], set()
+        for i, _ in plan.downstream(name):
+            try:
+                v[i] = types.FunctionType(self.codes[i], ns)(v)
+            except NotLinear:
+                if arrays is None: arrays = self._batch_ns(profile)
+                v[i] = self._sample(i, v, arrays, lo, hi)
+                sampled.append(engine.names[i])
+                inexact.add(i)
+            if any(p in inexact for p in engine.graph.parents[i]): inexact.add(i)
+
+        curves = dict()
+        for out in outputs:
+            f = v[engine.slots[out]]
+            if not isinstance(f, Piecewise): f = Piecewise.line(float(lo), float(hi), float(f or 0), 0.)
+            curves[out] = dict(exact=engine.slots[out] not in inexact,
+                               breakpoints=[round(x, 4) for x in f.breakpoints()],
+                               pieces=[dict(start=round(x0, 4), end=round(x1, 4), value=round(y, 4),
+                                            slope=round(s, 6)) for x0, x1, y, s in f.pieces()])
+        return dict(input=name, value=inputs.get(name, 0) or 0, low=lo, high=hi,
+                    sampled=sampled, tolerance=self.tol if sampled else 0., outputs=curves)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="taxes.py curve",
+                                     description="Refund and tax owed as piecewise-linear functions of one input.")
+    parser.add_argument("--input", default="f1040_wages", help="input cell to vary (default: wages)")
+    parser.add_argument("--low", type=float, default=0)
+    parser.add_argument("--high", type=float, default=500000)
+    parser.add_argument("--samples", type=int, default=2001, help="grid points for cells that have to be sampled")
+    parser.add_argument("--interview", default="interview.py")
+    parser.add_argument("--inform", default="inform.py")
+    parser.add_argument("--json", action="store_true")
+    opts = parser.parse_args(args)
+
+    interview, inform = read_answers(opts.interview), read_answers(opts.inform)
+    try:
+        result = Curves(load(), opts.samples).curve(profile_from(interview), inform,
+                                                    opts.input, opts.low, opts.high)
+    except (GraphError, ValueError) as e:
+        parser.error(str(e))
+
+    if opts.json:
+        sys.stdout.write(json.dumps(result) + "\n")
+        return
+    if result["sampled"]:
+        print("Sampled, each to within about $%g: %s" % (result["tolerance"], ", ".join(result["sampled"])))
+    for out, c in result["outputs"].items():
+        print("%s over %s: %d pieces%s" % (out, opts.input, len(c["pieces"]), "" if c["exact"] else " (sampled)"))
+        for p in c["pieces"]:
+            print("  %12.2f to %12.2f  starts at %12.2f  slope %+.4f" % (p["start"], p["end"], p["value"], p["slope"]))
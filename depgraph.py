@@ -0,0 +1,188 @@
+"""The shape of the cell graph: exports and the numbers that say where the
+work is.
+
+Everything here walks the graph once, in topological order, with each cell
+visited once however many paths lead to it: the exports write every edge
+once, and ancestor and descendant sets are bitmasks built up from the
+parents' or children's, as Graph.below() does for one cell.
+
+For each cell: its depth (the longest chain of cells above it), fan-in and
+fan-out, and how many cells it reads from (upstream) and feeds (downstream;
+what set_input() or Plan.downstream() would re-run). For each output, the
+longest chain of cells leading to it. For each form, how many cells it has,
+the edges inside it and across its border, and how many cells it takes to
+compute it. Cells deep on a long chain and with a large downstream are the
+ones to make fast first.
+
+From the command line: python taxes.py graph [--format text|json|dot] [-o FILE]
+"""
+
+import argparse
+import json
+import sys
+
+from engine import TARGETS, GraphError, topo_order, load
+
+
+def _ones(mask):
+    return bin(mask).count("1")
+
+
+def order(engine):
+    """Every slot, parents before children."""
+    slots = engine.slots
+    return [slots[name] for name in topo_order(engine.deps, None, engine.cell_list)]
+
+
+def edges(engine, targets=None):
+    """(parent, child) names for every edge above the targets (or in the
+    whole graph), each once, parents' edges first."""
+    g = engine.graph
+    names = engine.names
+    for name in topo_order(engine.deps, targets, engine.cell_list):
+        i = engine.slots[name]
+        for p in g.parents[i]:
+            yield names[p], name
+
+
+def to_dot(engine, targets=None):
+    """Graphviz source for the graph above the targets, one edge per line."""
+    yield "digraph {\n"
+    for parent, child in edges(engine, targets):
+        yield "%s  -> %s \n" % (parent, child)
+    yield "}\n"
+
+
+def max_upstream(engine, values, name):
+    """The largest value among a cell and every cell it depends on."""
+    parents = engine.graph.parents
+    seen = {engine.slots[name]}
+    todo = list(seen)
+    while todo:
+        for p in parents[todo.pop()]:
+            if p not in seen:
+                seen.add(p)
+                todo.append(p)
+    return max(values[i] for i in seen)
+
+
+def analyze(engine, outputs=TARGETS, top=10):
+    """The statistics above, as a dict ready for json.dumps()."""
+    g = engine.graph
+    names = engine.names
+    for out in outputs:
+        if out not in engine.slots: raise GraphError("No cell named %s" % (out,))
+    topo = order(engine)
+
+    depth = [0] * len(names)
+    via = [None] * len(names)   # the parent on the longest chain
+    above = [0] * len(names)
+    for i in topo:
+        mask = 1 << i
+        for p in g.parents[i]:
+            mask |= above[p]
+            if depth[p] + 1 > depth[i]:
+                depth[i] = depth[p] + 1
+                via[i] = p
+        above[i] = mask
+    below = [0] * len(names)
+    for i in reversed(topo):
+        mask = 1 << i
+        for c in g.children[i]:
+            mask |= below[c]
+        below[i] = mask
+
+    cells = [dict(cell=names[i], form=g.form[i], input=i in g.inputs, depth=depth[i],
+                  fan_in=len(g.parents[i]), fan_out=len(g.children[i]),
+                  upstream=_ones(above[i]) - 1, downstream=_ones(below[i]) - 1)
+             for i in topo]
+
+    chains = []
+    for out in outputs:
+        i = engine.slots[out]
+        chain = []
+        k = i
+        while k is not None:
+            chain.append(names[k])
+            k = via[k]
+        chains.append(dict(output=out, depth=depth[i], upstream=_ones(above[i]) - 1,
+                           inputs=sum(1 for k in g.inputs if above[i] >> k & 1),
+                           chain=chain[::-1]))
+
+    forms = dict()
+    for i in topo:
+        f = forms.setdefault(g.form[i], dict(form=g.form[i], cells=0, inputs=0, internal_edges=0,
+                                             edges_in=0, edges_out=0, needs=0))
+        f["cells"] += 1
+        f["inputs"] += i in g.inputs
+        f["needs"] |= above[i]
+        for p in g.parents[i]:
+            if g.form[p] == g.form[i]: f["internal_edges"] += 1
+            else:
+                f["edges_in"] += 1
+                forms.setdefault(g.form[p], dict(form=g.form[p], cells=0, inputs=0, internal_edges=0,
+                                                 edges_in=0, edges_out=0, needs=0))["edges_out"] += 1
+    for f in forms.values():
+        f["needs"] = _ones(f["needs"])   # cells it takes to compute the form, its own included
+
+    rank = lambda key: [dict((k, c[k]) for k in ("cell", key))
+                        for c in sorted(cells, key=lambda c: (-c[key], c["cell"]))[:top]]
+    return dict(cells=len(names), inputs=len(g.inputs), edges=sum(len(p) for p in g.parents),
+                depth=max(depth), outputs=chains,
+                forms=sorted(forms.values(), key=lambda f: (-f["needs"], f["form"])),
+                fan_in=rank("fan_in"), fan_out=rank("fan_out"), downstream=rank("downstream"),
+                nodes=cells)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="taxes.py graph",
+                                     description="Depth, fan-in/out, longest chains and form sizes of the cell graph.")
+    parser.add_argument("--format", choices=("text", "json", "dot"), default="text")
+    parser.add_argument("--output", action="append", default=None, metavar="CELL",
+                        help="an output to trace the longest chain to; repeat for more (default: %s)"
+                        % ", ".join(TARGETS))
+    parser.add_argument("--top", type=int, default=10, help="how many cells to list per ranking")
+    parser.add_argument("-o", "--out", default=None, help="write here instead of stdout")
+    opts = parser.parse_args(args)
+
+    engine = load()
+    outputs = opts.output or TARGETS
+    try:
+        if opts.format == "dot":
+            chunks = list(to_dot(engine, outputs if opts.output else None))
+        else:
+            report = analyze(engine, outputs, opts.top)
+    except GraphError as e:
+        parser.error(str(e))
+    out = open(opts.out, "w") if opts.out else sys.stdout
+    try:
+        if opts.format == "dot":
+            out.writelines(chunks)
+        elif opts.format == "json":
+            json.dump(report, out)
+            out.write("\n")
+        else:
+            _print_report(report, out)
+    finally:
+        if opts.out: out.close()
+
+
+def _print_report(r, out):
+    w = lambda s="": out.write(s + "\n")
+    w("%d cells (%d inputs), %d edges, %d deep" % (r["cells"], r["inputs"], r["edges"], r["depth"]))
+    for c in r["outputs"]:
+        w()
+        w("%s: %d deep, reads %d cells (%d inputs); longest chain:"
+          % (c["output"], c["depth"], c["upstream"], c["inputs"]))
+        w("  " + " -> ".join(c["chain"]))
+    w()
+    w("%-24s %6s %6s %9s %6s %6s %6s" % ("form", "cells", "inputs", "internal", "in", "out", "needs"))
+    for f in r["forms"]:
+        w("%-24s %6d %6d %9d %6d %6d %6d" % (f["form"], f["cells"], f["inputs"], f["internal_edges"],
+                                            f["edges_in"], f["edges_out"], f["needs"]))
+    for key, label in (("downstream", "Most cells downstream"), ("fan_in", "Most parents"),
+                       ("fan_out", "Most children")):
+        w()
+        w(label + ":")
+        for c in r[key]:
+            w("  %-50s %d" % (c["cell"], c[key]))
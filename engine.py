@@ -0,0 +1,527 @@
+"""Evaluate the cell graph in a single linear pass.
+
+cell.compute() recurses through every parent and then re-walks the whole
+ancestor tree via check_done(), so shared subgraphs like f1040_AGI get visited
+over and over. Here the order is worked out once from `deps` when the engine
+is built; after that a return is one loop over the list.
+
+The calc strings are also compiled once, into functions of a single list `v`
+holding every cell's value: Cv('f1040_AGI') becomes v[17], so evaluating a
+cell neither re-parses its source nor looks anything up in cell_list.
+
+For what-if runs, set_input() marks only the cells downstream of the changed
+input as dirty (via the reverse of `deps`), and recompute() re-evaluates just
+those.
+
+evaluate(profile, inputs) runs a Plan specialized to one set of interview
+answers. Inputs gated off by the profile (a W-2 filer has no Schedule C) are
+taken as zero, so every cell that doesn't depend on a live input is folded to
+a constant when the plan is built. Plans are kept in an LRU keyed by profile.
+
+load() reads cells.py and taxforms.py once into a private namespace; a server
+builds one Engine at startup and then only calls evaluate() per request.
+
+What doesn't change between returns (names, text, calcs, flags, the edges)
+is a Graph, shared by everyone. What does is a State: one float per cell and
+one bit per cell saying whether it is up to date, about 2 KB for the whole
+graph. compute(), set_input() and recompute() take a State, so one engine
+can keep any number of returns in flight; without one they work on the
+engine's own, which also updates cell_list for taxes.py.
+"""
+
+import ast
+import hashlib
+import math
+import os
+import types
+from array import array
+from functools import lru_cache
+from time import perf_counter_ns
+from types import MappingProxyType
+
+from params import DEFAULT_YEAR, STATUSES, YEARS
+
+TARGETS = ("f1040_refund", "f1040_tax_owed", "f8582_carryover_to_next_year")
+
+# The interview answers, with interview_template.py's defaults.
+# tax_year picks the table in params.py that taxforms.py's helpers read.
+PROFILE_DEFAULTS = dict(status="single", itemizing=False, over_65=False,
+                        spouse_over_65=False, kids=0, dependents=0, s_loans=False,
+                        cap_gains=False, have_rr=False, self_emp=False,
+                        tax_year=DEFAULT_YEAR)
+
+
+# What the API's interview answers call the filing statuses taxforms.py knows.
+STATUS_NAMES = {"married": "married filing jointly",
+                "head_of_household": "head of household"}
+
+# The short names the API reports the targets under.
+RESULT_NAMES = dict(f1040_refund="refund", f1040_tax_owed="tax_owed",
+                    f8582_carryover_to_next_year="carryover_to_next_year")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARAMS_PATH = os.path.join(HERE, "params.py")
+
+
+class GraphError(Exception):
+    pass
+
+
+def is_input(c):
+    """Cells the user fills in via inform.py, as setup_inform() decides."""
+    return c.flag.find('u') > -1
+
+
+def gates(c):
+    """The interview answers named in an input cell's flag, e.g. 'u itemizing'."""
+    return [g for g in c.flag.split() if g in PROFILE_DEFAULTS]
+
+
+def gate_open(c, profile):
+    """An input is live if it isn't gated, or if any of its gates is answered yes."""
+    g = gates(c)
+    return not g or any(profile[k] for k in g)
+
+
+def topo_order(deps, targets=None, cells=None):
+    """List the ancestors of targets (or every cell), parents before children.
+
+    Walks with an explicit stack, so no recursion limit. Raises GraphError on a
+    dependency that isn't defined or on a cycle.
+    """
+    if cells is None: cells = deps
+    if targets is None: targets = list(deps.keys())
+    order = []
+    state = dict()   # 1 = on the stack, 2 = placed in order
+    for t in targets:
+        if t not in deps or t not in cells:
+            raise GraphError("Unknown cell %s" % (t,))
+        if state.get(t) == 2: continue
+        stack = [(t, iter(deps[t] or ()))]
+        state[t] = 1
+        while stack:
+            name, parents = stack[-1]
+            for p in parents:
+                if p == "": continue
+                if p not in deps or p not in cells:
+                    raise GraphError("Missing dependency for %s: %s" % (name, p))
+                seen = state.get(p)
+                if seen == 2: continue
+                if seen == 1:
+                    path = [n for n, _ in stack]
+                    raise GraphError("Cycle: " + " -> ".join(path[path.index(p):] + [p]))
+                state[p] = 1
+                stack.append((p, iter(deps[p] or ())))
+                break
+            else:
+                stack.pop()
+                state[name] = 2
+                order.append(name)
+    return order
+
+
+class _CvToSlot(ast.NodeTransformer):
+    def __init__(self, slots, name):
+        self.slots = slots
+        self.name = name
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        f = node.func
+        if not (isinstance(f, ast.Name) and f.id == "Cv"):
+            return node
+        if len(node.args) != 1 or not isinstance(node.args[0], ast.Constant):
+            raise GraphError("%s: Cv() needs a literal cell name" % (self.name,))
+        label = node.args[0].value
+        if label not in self.slots:
+            raise GraphError("Missing dependency for %s: %s" % (self.name, label))
+        return ast.copy_location(
+            ast.Subscript(value=ast.Name(id="v", ctx=ast.Load()),
+                          slice=ast.Constant(value=self.slots[label]), ctx=ast.Load()), node)
+
+
+def calc_code(name, calc, slots, *transforms):
+    """Compile a calc string to code for `lambda v: ...` over the value list.
+
+    Any extra ast.NodeTransformers are run over the expression after the Cv()
+    references have been replaced."""
+    body = _CvToSlot(slots, name).visit(ast.parse(calc.strip() or "0", mode="eval").body)
+    for t in transforms:
+        body = t.visit(body)
+    fn = ast.parse("lambda v: 0", mode="eval")
+    fn.body.body = body
+    ast.fix_missing_locations(fn)
+    return compile(fn, "<cell %s>" % (name,), "eval")
+
+
+def compile_calc(name, calc, slots, ns, *transforms):
+    """Turn a calc string into a function of the value list, bound to ns."""
+    return eval(calc_code(name, calc, slots, *transforms), ns)
+
+
+def bind(ns, profile):
+    """A copy of ns with the profile's interview answers set, and with every
+    function defined in ns re-pointed at the copy, so fstatus() and friends
+    see this profile and not whatever ns holds."""
+    out = dict(ns)
+    out.update(profile)
+    for k, f in ns.items():
+        if isinstance(f, types.FunctionType) and f.__globals__ is ns:
+            out[k] = types.FunctionType(f.__code__, out, f.__name__, f.__defaults__, f.__closure__)
+    return out
+
+
+class Plan():
+    """The part of the graph one interview profile needs.
+
+    Cells that don't depend on any live input are evaluated once, here, and
+    kept in `constants`; evaluate() runs the remaining `steps` only."""
+    def __init__(self, engine, profile, prune=True):
+        self.profile = profile
+        self.engine = engine
+        self._downstream = dict()
+        ns = bind(engine.ns, profile)
+        self.inputs = [(name, i) for name, i in engine.inputs
+                       if not prune or gate_open(engine.cell_list[name], profile)]
+        live_names = set(name for name, _ in self.inputs)
+        self.pruned = [name for name, _ in engine.inputs if name not in live_names]
+        live = set()
+        for name in live_names:
+            live |= engine.dependents(name)
+
+        v = [0] * len(engine.names)
+        self.steps = []
+        for name, i, fn in engine.plan:
+            fn = types.FunctionType(fn.__code__, ns)
+            if name in live: self.steps.append((i, fn))
+            else: v[i] = fn(v)
+        self.constants = v
+
+    def accepts(self, inputs):
+        """False if the caller gave a value to an input this plan dropped."""
+        for name in self.pruned:
+            if inputs.get(name, 0): return False
+        return True
+
+    def evaluate(self, inputs):
+        v = self.constants[:]
+        for name, i in self.inputs:
+            v[i] = inputs.get(name, 0)
+        for i, fn in self.steps:
+            v[i] = fn(v)
+        return v
+
+    def downstream(self, name):
+        """The steps that read input `name`, directly or not, in order."""
+        if name not in self._downstream:
+            below = self.engine.dependents(name)
+            names = self.engine.names
+            self._downstream[name] = [(i, fn) for i, fn in self.steps if names[i] in below]
+        return self._downstream[name]
+
+
+class Graph():
+    """The static half of the cells, as parallel tuples indexed by slot
+    (cell_list order). Built once and never modified."""
+    __slots__ = ("names", "slots", "text", "line", "calc", "flag", "form",
+                 "parents", "children", "inputs")
+
+    def __init__(self, cell_list, deps):
+        names = tuple(cell_list)
+        slots = {name: i for i, name in enumerate(names)}
+        cells = [cell_list[name] for name in names]
+        self.names = names
+        self.slots = MappingProxyType(slots)
+        self.text = tuple(c.text for c in cells)
+        self.line = tuple(c.line for c in cells)
+        self.calc = tuple(c.calc for c in cells)
+        self.flag = tuple(c.flag for c in cells)
+        self.form = tuple(c.form for c in cells)
+        parents = []
+        for name in names:
+            ps = [p for p in dict.fromkeys(deps.get(name) or ()) if p != ""]
+            for p in ps:
+                if p not in slots: raise GraphError("Missing dependency for %s: %s" % (name, p))
+            parents.append(tuple(slots[p] for p in ps))
+        children = [[] for _ in names]
+        for i, ps in enumerate(parents):
+            for p in ps:
+                children[p].append(i)
+        self.parents = tuple(parents)
+        self.children = tuple(tuple(c) for c in children)
+        self.inputs = frozenset(i for i, c in enumerate(cells) if is_input(c))
+
+    def below(self, i):
+        """Slot i and the slots of every cell that depends on it, as a bitmask."""
+        mask = 1 << i
+        todo = [i]
+        while todo:
+            for c in self.children[todo.pop()]:
+                if not mask >> c & 1:
+                    mask |= 1 << c
+                    todo.append(c)
+        return mask
+
+
+class State():
+    """One return: a float per cell, and a bitmask of the cells whose value
+    is current. With floats=False the values are a plain list, which keeps
+    ints as ints (and 0 apart from -0.0) for printing cells exactly as
+    cell.compute() left them."""
+    __slots__ = ("values", "computed")
+
+    def __init__(self, size, floats=True):
+        self.values = array("d", bytes(8 * size)) if floats else [0] * size
+        self.computed = 0
+
+
+class Engine():
+    def __init__(self, cell_list, deps, ns, targets=TARGETS, plan_cache_size=128, compiled=None):
+        """ns is the namespace the calc strings are evaluated in: the one
+        taxforms.py and the interview/inform values were loaded into.
+        compiled optionally maps cell names to calc_code() output, as
+        formc.py stores it, so those calcs aren't compiled again."""
+        self.cell_list = cell_list
+        self.deps = deps
+        self.ns = ns
+        self.targets = tuple(targets)
+        self.version = None   # load() sets a hash of the form sources
+        self.order = topo_order(deps, self.targets, cell_list)
+
+        self.graph = Graph(cell_list, deps)
+        self.names = self.graph.names
+        self.slots = self.graph.slots
+        self.inputs = [(name, self.slots[name]) for name in self.order
+                       if is_input(cell_list[name])]
+        if compiled is None: compiled = dict()
+        self.plan = [(name, self.slots[name],
+                      eval(compiled[name], ns) if name in compiled
+                      else compile_calc(name, cell_list[name].calc, self.slots, ns))
+                     for name in self.order if not is_input(cell_list[name])]
+        self.position = {name: k for k, (name, _, _) in enumerate(self.plan)}
+        self.slot_position = {i: k for k, (_, i, _) in enumerate(self.plan)}
+        self.plan_bits = sum(1 << i for _, i, _ in self.plan)
+        self.input_bits = sum(1 << i for _, i in self.inputs)
+        self._below = dict()
+        self.state = State(len(self.names), floats=False)
+        self._plan = lru_cache(maxsize=plan_cache_size)(
+                            lambda key, prune: Plan(self, dict(key), prune))
+        self.codegen_dir = None   # set to use codegen.py's straight-line functions
+        self.trace = None         # a tracing.Trace to time compute() and recompute()
+        self._generated = lru_cache(maxsize=plan_cache_size)(self._generate)
+
+    def _generate(self, key, prune):
+        from codegen import Generated
+        return Generated(self, dict(key), prune, self.codegen_dir)
+
+    def profile_key(self, profile):
+        return tuple((k, profile.get(k, d)) for k, d in PROFILE_DEFAULTS.items())
+
+    def plan_for(self, profile, prune=True):
+        return self._plan(self.profile_key(profile), prune)
+
+    def evaluate(self, profile, inputs):
+        """Values of every cell for one return, as a list indexed by self.slots.
+        Leaves the engine's own values and the cells untouched."""
+        plan = self.plan_for(profile)
+        if not plan.accepts(inputs):
+            plan = self.plan_for(profile, prune=False)
+        return plan.evaluate(inputs)
+
+    def target_values(self, profile, inputs):
+        """Target name -> value for one return. Runs the generated code for
+        the profile if codegen_dir is set, else the plan."""
+        if self.codegen_dir is None:
+            v = self.evaluate(profile, inputs)
+            return dict((name, v[self.slots[name]]) for name in self.targets)
+        key = self.profile_key(profile)
+        gen = self._generated(key, True)
+        if not gen.accepts(inputs):
+            gen = self._generated(key, False)
+        return dict(zip(self.targets, gen.evaluate(inputs)))
+
+    def summary(self, interview, inform):
+        """Refund, tax owed and carryover for one return, rounded to cents,
+        straight from the interview and form answers."""
+        values = self.target_values(profile_from(interview), inform)
+        return dict((short, round(values.get(name) or 0, 2))
+                    for name, short in RESULT_NAMES.items())
+
+    def new_state(self):
+        return State(len(self.names))
+
+    def compute(self, inputs=None, state=None):
+        """Evaluate every target into state (default: the engine's own). Input
+        cells are read from `inputs` (default: the namespace, where `from
+        inform import *` put them); missing ones are 0."""
+        if inputs is None: inputs = self.ns
+        if state is None: state = self.state
+        v = state.values
+        for name, i in self.inputs:
+            v[i] = inputs.get(name, 0)
+        trace = self.trace
+        if trace is not None:
+            for name, i, fn in self.plan:
+                start = perf_counter_ns()
+                v[i] = fn(v)
+                trace.cell(name, start, perf_counter_ns())
+        else:
+            for _, i, fn in self.plan:
+                v[i] = fn(v)
+        state.computed = self.input_bits | self.plan_bits
+        if state is self.state:
+            for name in self.order:
+                c = self.cell_list[name]
+                c.value = v[self.slots[name]]
+                c.done = True
+
+    def dependents(self, name):
+        """name and every cell that depends on it, directly or not."""
+        mask = self._below_mask(self.slots[name])
+        return set(n for i, n in enumerate(self.names) if mask >> i & 1)
+
+    def _below_mask(self, i):
+        if i not in self._below:
+            self._below[i] = self.graph.below(i)
+        return self._below[i]
+
+    def set_input(self, name, value, state=None):
+        """Change one input cell; recompute() will then redo only what it feeds."""
+        if name not in self.slots or self.slots[name] not in self.graph.inputs:
+            raise GraphError("%s is not an input cell" % (name,))
+        if state is None: state = self.state
+        i = self.slots[name]
+        if state.computed >> i & 1 and state.values[i] == value: return
+        state.values[i] = value
+        state.computed = state.computed & ~self._below_mask(i) | 1 << i
+        if state is self.state:
+            self.cell_list[name].value = value
+
+    def recompute(self, state=None):
+        """Re-evaluate the cells that aren't current, reading inputs as they
+        stand in the state. Returns how many were evaluated."""
+        if state is None: state = self.state
+        stale = self.plan_bits & ~state.computed
+        todo = []
+        while stale:
+            low = stale & -stale
+            todo.append(self.slot_position[low.bit_length() - 1])
+            stale ^= low
+        todo.sort()
+        v = state.values
+        own = state is self.state
+        trace = self.trace
+        if trace is not None:
+            done = set(todo)
+            for k, (name, _, _) in enumerate(self.plan):
+                if k not in done: trace.hit(name)
+        for k in todo:
+            name, i, fn = self.plan[k]
+            if trace is not None:
+                start = perf_counter_ns()
+                v[i] = fn(v)
+                trace.cell(name, start, perf_counter_ns())
+            else:
+                v[i] = fn(v)
+            if own: self.cell_list[name].value = v[i]
+        state.computed |= self.plan_bits
+        return len(todo)
+
+    def compute_eval(self):
+        """The old path: eval() each calc string, reading parents through Cv().
+        Needs setup_inform() to have pointed the input cells at their variables."""
+        trace = self.trace
+        for name in self.order:
+            c = self.cell_list[name]
+            start = perf_counter_ns()
+            c.value = eval(c.calc, self.ns)
+            if trace is not None: trace.cell(name, start, perf_counter_ns())
+            c.done = True
+        for name in self.order:
+            self.state.values[self.slots[name]] = self.cell_list[name].value
+        self.state.computed = self.input_bits | self.plan_bits
+
+    def value(self, name, state=None):
+        return (state or self.state).values[self.slots[name]]
+
+
+def load(forms_path=os.path.join(HERE, "taxforms.py"), cells_path=os.path.join(HERE, "cells.py"),
+         targets=TARGETS, codegen_dir=None):
+    """Build an Engine from the form definitions, in a namespace of its own.
+    With codegen_dir, summary() runs generated code cached in that directory."""
+    ns = dict(PROFILE_DEFAULTS, debug=False)
+    digest = hashlib.sha256()
+    for path in (cells_path, forms_path):
+        with open(path) as f:
+            src = f.read()
+        digest.update(src.encode())
+        exec(compile(src, path, "exec"), ns)
+    with open(PARAMS_PATH, "rb") as f:
+        digest.update(f.read())   # Cached results depend on the year tables too
+    engine = Engine(ns["cell_list"], ns["deps"], ns, targets)
+    engine.version = digest.hexdigest()[:16]
+    engine.codegen_dir = codegen_dir
+    return engine
+
+
+def read_answers(path):
+    """The `name = value` lines of an interview.py or inform.py, read without
+    executing the file. Anything that isn't a plain literal is skipped."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    out = dict()
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)):
+            try:
+                out[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass
+    return out
+
+
+def profile_from(answers):
+    """Interview answers -> a full profile, with defaults filled in, yes/no
+    strings turned into booleans and the API's status names spelled out.
+    Raises ValueError on a status, count or tax year the forms can't take."""
+    p = dict(PROFILE_DEFAULTS)
+    for k, d in PROFILE_DEFAULTS.items():
+        if k not in answers: continue
+        v = answers[k]
+        if isinstance(d, bool) and isinstance(v, str):
+            v = v.strip().lower() in ("yes", "y", "true")
+        elif isinstance(d, int) and not isinstance(d, bool) and not isinstance(v, int):
+            try:
+                v = int(v or 0)
+            except (TypeError, ValueError):
+                raise ValueError("%s must be a whole number, not %r" % (k, v))
+        p[k] = v
+    for k in ("kids", "dependents"):
+        if p[k] < 0: raise ValueError("%s can't be negative (%d)" % (k, p[k]))
+    if p["tax_year"] not in YEARS:
+        raise ValueError("No tax parameters for %r; known years are %s"
+                         % (p["tax_year"], ", ".join(map(str, sorted(YEARS)))))
+    p["status"] = STATUS_NAMES.get(p["status"], p["status"])
+    if p["status"] not in STATUSES:
+        raise ValueError("Unknown filing status %r; expected one of %s"
+                         % (p["status"], ", ".join(list(STATUS_NAMES) + list(STATUSES))))
+    if p["status"] == "single" and p["kids"] + p["dependents"] > 0:
+        p["status"] = "head of household"
+    return p
+
+
+def inputs_from(answers):
+    """Form answers -> input values: numbers as they are, numeric strings as
+    floats. Raises ValueError on anything else, or on a NaN or infinity."""
+    if not isinstance(answers, dict):
+        raise ValueError("Form answers must be an object of input names to numbers")
+    out = dict()
+    for k, v in answers.items():
+        if not isinstance(v, (int, float)):
+            try:
+                v = float(v)
+            except (TypeError, ValueError):
+                raise ValueError("%s must be a number, not %r" % (k, v))
+        if not math.isfinite(v): raise ValueError("%s must be a finite number, not %r" % (k, v))
+        out[k] = v
+    return out
@@ -0,0 +1,19 @@
+m4_form(fdemo)
+
+This text is commentary, as is anything outside a macro.
+
+pyversion(<|
+def fstatus():
+    return status   # Python comments and CV( in quotes are left alone
+|>)
+
+Cell(wages, 1, <|Wages, salaries, tips|>, , u)
+Cell(interest, 2, Taxable interest, , u
+    )
+Cell(total, 3, Total income, <|SUM(wages, interest)|>, critical)
+Cell(std, 4, Standard deduction, <|Fswitch((married filing jointly, 24000), (head of household, 18000), 12000)|>, )
+Cell(ti, 5, Taxable income, <|max(CV(total) - CV(std), 0)|>, )
+Cell(credit, 6, Some credit, <|IF(CV(ti) > 1000, CV(sdemo, line1), 0)
+        + CV(total)*0.01|>, kids)
+Cell(tax, 7, Tax, <|CV(ti)*0.1 - CV(credit)|> m4_dnl trailing stuff
+    , )
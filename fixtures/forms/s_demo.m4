@@ -0,0 +1,7 @@
+m4_form(sdemo)
+# A comment with Cell(bogus, 1, x, , u) in it is skipped.
+Cell(line1, 1, A line (with parens), , u itemizing)
+Cell(line2, 2, Doubled, <|2*CV(line1)
+                  + SUM(line1,
+                  line3)|>, itemizing)
+Cell(line3, 3.5, <|Capped, by status|>, <|min(CV(fdemo, wages), Fswitch((single, CV(line1)), IF(CV(line1) > 5, 1, 2)))|>, )
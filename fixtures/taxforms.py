@@ -0,0 +1,32 @@
+###AUTOGENERATED by formc.py. Please edit the sources.
+
+def fstatus():
+    return status   # Python comments and CV( in quotes are left alone
+
+
+deps = dict (
+fdemo_wages = [],
+fdemo_interest = [],
+fdemo_total = ["fdemo_wages", "fdemo_interest", ],
+fdemo_std = [],
+fdemo_ti = ["fdemo_total", "fdemo_std", ],
+fdemo_credit = ["fdemo_ti", "sdemo_line1", "fdemo_total", ],
+fdemo_tax = ["fdemo_ti", "fdemo_credit", ],
+sdemo_line1 = [],
+sdemo_line2 = ["sdemo_line1", "sdemo_line3", ],
+sdemo_line3 = ["fdemo_wages", "sdemo_line1", ],
+ )
+deps_verified = True   # formc.py checked deps against the calcs
+
+cell_list = dict(
+fdemo_wages = cell("Wages, salaries, tips", 1, "", flag="u", name="fdemo_wages", form="fdemo"),
+fdemo_interest = cell("Taxable interest", 2, "", flag="u    ", name="fdemo_interest", form="fdemo"),
+fdemo_total = cell("Total income", 3, "Cv('fdemo_wages') + Cv('fdemo_interest') + 0", flag="critical", name="fdemo_total", form="fdemo"),
+fdemo_std = cell("Standard deduction", 4, "((24000) if (fstatus()=='married filing jointly') else (((18000) if (fstatus()=='head of household') else (12000 )) )) ", flag="", name="fdemo_std", form="fdemo"),
+fdemo_ti = cell("Taxable income", 5, "max(Cv('fdemo_total') - Cv('fdemo_std'), 0)", flag="", name="fdemo_ti", form="fdemo"),
+fdemo_credit = cell("Some credit", 6, "((Cv('sdemo_line1')) if (Cv('fdemo_ti') > 1000) else (0))        + Cv('fdemo_total')*0.01", flag="kids", name="fdemo_credit", form="fdemo"),
+fdemo_tax = cell("Tax", 7, "Cv('fdemo_ti')*0.1 - Cv('fdemo_credit')     ", flag="", name="fdemo_tax", form="fdemo"),
+sdemo_line1 = cell("A line (with parens)", 1, "", flag="u itemizing", name="sdemo_line1", form="sdemo"),
+sdemo_line2 = cell("Doubled", 2, "2*Cv('sdemo_line1')                  + Cv('sdemo_line1') + Cv('sdemo_line3') + 0", flag="itemizing", name="sdemo_line2", form="sdemo"),
+sdemo_line3 = cell("Capped, by status", 3.5, "min(Cv('fdemo_wages'), ((Cv('sdemo_line1')) if (fstatus()=='single') else (((1) if (Cv('sdemo_line1') > 5) else (2)) )) )", flag="", name="sdemo_line3", form="sdemo"),
+ )
@@ -0,0 +1,407 @@
+"""Compile the 1040.js form sources without m4.
+
+The forms in 1040.js/forms/*.m4 are m4 input: each form starts with
+m4_form(name), then has one Cell(name, line, text, calc, flag) per line of
+the form, with calcs written using CV, SUM, IF and Fswitch, and Python helper
+code in pyversion(<|...|>) blocks. Everything else is commentary. The
+makefile used to run m4 over them three times with macros/pull_*.m4; this
+module reads them directly, with the same quoting (<| |>), comment (#) and
+m4_dnl rules, and expands those macros to the same text the .m4 macro files
+produce. Each cell's deps are the cells its calc names via CV or SUM, in the
+order they appear in the source.
+
+Before anything is written, verify() checks each cell's deps against the Cv()
+calls in its calc's syntax tree and fails the build on any difference, on a
+reference to a cell that doesn't exist, or on a cycle. Repeated deps are
+dropped. The output then says deps_verified = True, and cell.compute() skips
+its per-evaluation dependency checks.
+
+Two outputs:
+
+  --py taxforms.py     the Python file m4 used to write, for taxes.py
+  -o taxforms.marshal  a marshal file holding the helper code compiled, the
+                       nodes and deps as plain data, and every calc compiled
+                       to code; load_engine() builds an Engine from it
+                       without exec'ing or compiling anything
+
+The marshal file records a hash of its sources, of engine.py (whose
+calc_code() compiles the calcs) and of the interpreter's cache tag, and is
+only rebuilt when one of them changes. A single already-generated taxforms.py is also accepted as a source.
+
+    python formc.py --py taxforms.py -o taxforms.marshal 1040.js/forms/f*.m4 1040.js/forms/s*.m4
+"""
+
+import argparse
+import ast
+import hashlib
+import marshal
+import os
+import re
+import sys
+
+from engine import TARGETS, PROFILE_DEFAULTS, PARAMS_PATH, HERE, Engine, GraphError, calc_code, topo_order
+
+FORMAT = 1   # Bump when the artifact layout changes
+ARTIFACT = os.path.join(HERE, "__pycache__", "taxforms.marshal")
+COMPILER = os.path.join(HERE, "engine.py")   # calc_code(), which turns calcs into the code stored
+HEADER = "###AUTOGENERATED by formc.py. Please edit the sources.\n"
+
+_word = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class FormError(Exception):
+    pass
+
+
+class Forms():
+    """What a set of form sources defines: helper code, cells and deps."""
+    def __init__(self):
+        self.fns = []     # pyversion blocks, in order
+        self.nodes = []   # (name, text, line, calc, flag, form)
+        self.deps = dict()
+        self.verified = False
+
+
+class _Reader():
+    """Expand one m4 source file into a Forms."""
+    def __init__(self, forms, path, form=None):
+        self.forms = forms
+        self.path = path
+        self.form = form
+        self.refs = []
+        self.macros = dict(m4_form=self.m4_form, pyversion=self.pyversion, Cell=self.cell,
+                           CV=self.cv, SUM=self.sum, IF=self.if_, Fswitch=self.fswitch)
+
+    def error(self, s, pos, msg):
+        raise FormError("%s:%d: %s" % (self.path, s.count("\n", 0, pos) + 1, msg))
+
+    def quoted(self, s, pos):
+        """s[pos:] starts with <|. Returns the text inside, one level of quotes removed."""
+        depth, i = 1, pos + 2
+        while depth:
+            j = s.find("|>", i)
+            k = s.find("<|", i)
+            if j < 0: self.error(s, pos, "end of file in quoted string")
+            if 0 <= k < j:
+                depth += 1
+                i = k + 2
+            else:
+                depth -= 1
+                i = j + 2
+        return s[pos + 2:i - 2], i
+
+    def comment(self, s, pos):
+        end = s.find("\n", pos)
+        end = len(s) if end < 0 else end + 1
+        return s[pos:end], end
+
+    def expand(self, s):
+        """m4's main loop, for the macros above. Returns the output text."""
+        out, pos = [], 0
+        while pos < len(s):
+            text, pos = self.token(s, pos)
+            out.append(text)
+        return "".join(out)
+
+    def token(self, s, pos):
+        if s.startswith("<|", pos):
+            return self.quoted(s, pos)
+        c = s[pos]
+        if c == "#":
+            return self.comment(s, pos)
+        m = _word.match(s, pos)
+        if not m:
+            return c, pos + 1
+        word, pos = m.group(), m.end()
+        if word == "m4_dnl":
+            return "", self.comment(s, pos)[1]
+        if word.startswith("m4_") and word not in self.macros:
+            self.error(s, pos, "%s isn't supported in form sources" % (word,))
+        if word not in self.macros:
+            return word, pos
+        args = []
+        if word == "Cell": self.refs = []
+        if s.startswith("(", pos):
+            args, pos = self.arguments(s, pos + 1)
+        # Macro output is rescanned, so quoted arguments get expanded too.
+        return self.expand(self.macros[word](*args)), pos
+
+    def arguments(self, s, pos):
+        """Collect the arguments of a call, s[pos:] being just past the '('.
+        Leading whitespace is dropped, macros are expanded, quotes removed."""
+        args, cur, depth = [], [], 0
+        while True:
+            if not cur:
+                while pos < len(s) and s[pos] in " \t\n": pos += 1
+            if pos >= len(s): self.error(s, pos, "end of file in argument list")
+            c = s[pos]
+            if c == "(":
+                depth += 1
+            elif c == ")" and depth:
+                depth -= 1
+            elif c == ")":
+                args.append("".join(cur))
+                return args, pos + 1
+            elif c == "," and not depth:
+                args.append("".join(cur))
+                cur, pos = [], pos + 1
+                continue
+            text, pos = self.token(s, pos)
+            cur.append(text)
+
+    # The macros. Each returns the text m4 would produce for pull_nodes.m4.
+    def m4_form(self, name="", *rest):
+        self.form = name
+        return ""
+
+    def pyversion(self, code="", *rest):
+        self.forms.fns.append(code + "\n")
+        return ""
+
+    def cell(self, name="", line="", text="", calc="", flag="", *rest):
+        if self.form is None: raise FormError("%s: Cell(%s) before m4_form()" % (self.path, name))
+        calc = self.expand(calc).replace("\n", "")
+        full = self.expand("%s_%s" % (self.form, name))
+        self.forms.nodes.append((full, self.expand(text), self.expand(line).replace("\n", ""),
+                                 calc, self.expand(flag).replace("\n", ""), self.form))
+        self.forms.deps[full] = self.refs
+        self.refs = []
+        return ""
+
+    def cv(self, *args):
+        if len(args) == 1: form, name = self.form, args[0]
+        else: form, name = (args + ("", ""))[:2]
+        label = "%s_%s" % (form.replace("\n", ""), name.replace("\n", ""))
+        self.refs.append(label)
+        return "Cv('%s')" % (label,)
+
+    def sum(self, *args):
+        out = []
+        for a in args:
+            if not a: break
+            out.append(self.cv(a.replace("\n", "")) + " + ")
+        return "".join(out) + "0"
+
+    def if_(self, cond="", a="", b="", *rest):
+        return "((%s) if (%s) else (%s))" % (a, cond, b)
+
+    def fswitch(self, *args):
+        if len(args) <= 1:
+            return (args[0] if args else "") + " "
+        s = args[0]
+        if not s.startswith("("):
+            raise FormError("%s: Fswitch cases look like (status, value), not %r" % (self.path, s))
+        case, _ = self.arguments(s, 1)
+        status, value = (case + ["", ""])[:2]
+        return "((%s) if (fstatus()=='%s') else (%s)) " % (value, status, self.fswitch(*args[1:]))
+
+
+def read_forms(paths):
+    """Parse m4 form sources, in the given order, into one Forms."""
+    forms = Forms()
+    form = None
+    for path in paths:
+        with open(path) as f:
+            r = _Reader(forms, path, form)
+            r.expand(f.read())
+            form = r.form   # m4 keeps the form name across files
+    return forms
+
+
+def read_generated(path):
+    """A taxforms.py that m4 or formc.py already wrote, as a Forms."""
+    with open(path) as f:
+        src = f.read()
+    split = src.find("\ndeps = dict (")
+    if split < 0: raise FormError("%s doesn't look like a generated taxforms.py" % (path,))
+    ns = dict(PROFILE_DEFAULTS, debug=False, cell=lambda *a, **kw: (a, kw))
+    exec(compile(src, path, "exec"), ns)
+    forms = Forms()
+    forms.fns.append(src[:split].split("\n", 1)[1] if src.startswith("###") else src[:split])
+    for name, (a, kw) in ns["cell_list"].items():
+        text, line = a[0], a[1]
+        calc = a[2] if len(a) > 2 else kw.get("calc", "0")
+        forms.nodes.append((name, text, repr(line), calc, kw.get("flag", "c"), kw.get("form", "1040")))
+        forms.deps[name] = list(ns["deps"].get(name) or ())
+    return forms
+
+
+def calc_refs(name, calc):
+    """The cells a calc reads through Cv(), from its syntax tree."""
+    try:
+        tree = ast.parse(calc.strip() or "0", mode="eval")
+    except SyntaxError as e:
+        raise FormError("%s: bad calc %r: %s" % (name, calc, e.msg))
+    out = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "Cv":
+            if len(node.args) != 1 or not isinstance(node.args[0], ast.Constant):
+                raise FormError("%s: Cv() needs a literal cell name" % (name,))
+            out.add(node.args[0].value)
+    return out
+
+
+def verify(forms):
+    """Check every cell's declared deps against what its calc actually reads,
+    and that the graph has no unknown cells or cycles. Raises FormError listing
+    every problem. On success the deps are deduplicated (keeping the declared
+    order) and forms.verified is set; returns {cell: duplicates dropped}."""
+    problems, dropped = [], dict()
+    for name, text, line, calc, flag, form in forms.nodes:
+        if "u" in flag: continue   # input cells aren't evaluated
+        declared = [d for d in forms.deps.get(name, ()) if d]
+        read = calc_refs(name, calc)
+        for d in sorted(read - set(declared)):
+            problems.append("%s reads %s but doesn't list it in deps" % (name, d))
+        for d in sorted(set(declared) - read):
+            problems.append("%s lists %s in deps but never reads it" % (name, d))
+        for d in sorted(read):
+            if d not in forms.deps:
+                problems.append("%s reads %s, which isn't a cell" % (name, d))
+        unique = list(dict.fromkeys(declared))
+        if len(unique) < len(declared):
+            dropped[name] = sorted(set(d for d in declared if declared.count(d) > 1))
+        forms.deps[name] = unique
+    if not problems:
+        try:
+            topo_order(forms.deps)
+        except GraphError as e:
+            problems.append(str(e))
+    if problems:
+        raise FormError("deps don't match the calcs:\n  " + "\n  ".join(problems))
+    forms.verified = True
+    return dropped
+
+
+def python_source(forms):
+    """The taxforms.py text, laid out as the three m4 passes wrote it."""
+    out = [HEADER] + forms.fns
+    out.append("\ndeps = dict (\n")
+    for name, *_ in forms.nodes:
+        out.append("%s = [%s],\n" % (name, "".join('"%s", ' % (d,) for d in forms.deps[name])))
+    out.append(" )\n")
+    if forms.verified:
+        out.append("deps_verified = True   # formc.py checked deps against the calcs\n")
+    out.append("\ncell_list = dict(\n")
+    for name, text, line, calc, flag, form in forms.nodes:
+        out.append('%s = cell("%s", %s, "%s", flag="%s", name="%s", form="%s"),\n'
+                   % (name, text, line, calc, flag, name, form))
+    out.append(" )\n")
+    return "".join(out)
+
+
+def source_hash(paths, tag=""):
+    h = hashlib.sha256(("formc %d%s\n" % (FORMAT, tag)).encode())
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def read(paths):
+    """Parse and verify the sources."""
+    if len(paths) == 1 and paths[0].endswith(".py"):
+        forms = read_generated(paths[0])
+    else:
+        forms = read_forms(paths)
+    verify(forms)
+    return forms
+
+
+def build_artifact(forms, sources):
+    """The marshal-ready dict for a verified Forms."""
+    names = [n[0] for n in forms.nodes]
+    slots = {name: i for i, name in enumerate(names)}
+    code = dict()
+    for name, text, line, calc, flag, form in forms.nodes:
+        if "u" in flag: continue   # input cells aren't evaluated
+        code[name] = calc_code(name, calc, slots)
+    nodes = []
+    for name, text, line, calc, flag, form in forms.nodes:
+        try:
+            line = ast.literal_eval(line)
+        except (ValueError, SyntaxError):
+            raise FormError("%s: line %r isn't a number" % (name, line))
+        nodes.append((name, text, line, calc, flag, form))
+    return dict(format=FORMAT, sources=sources,
+                fns=compile("".join(forms.fns), "<taxforms helpers>", "exec"),
+                nodes=nodes, deps=forms.deps, code=code)
+
+
+def read_artifact(path):
+    with open(path, "rb") as f:
+        data = marshal.load(f)
+    if not isinstance(data, dict) or data.get("format") != FORMAT:
+        raise FormError("%s is from another version of formc.py" % (path,))
+    return data
+
+
+def artifact_key(paths):
+    """What an artifact is valid for: its sources, the compiler that turned
+    their calcs into code, and the interpreter, since marshalled code only
+    loads on the Python version that wrote it."""
+    return source_hash(list(paths) + [COMPILER], " " + sys.implementation.cache_tag)
+
+
+def ensure_artifact(paths, out=ARTIFACT):
+    """The artifact for these sources, rebuilding out only if they, the
+    compiler or the interpreter changed."""
+    sources = artifact_key(paths)
+    try:
+        data = read_artifact(out)
+        if data["sources"] == sources: return data
+    except (OSError, EOFError, ValueError, TypeError, FormError):
+        pass
+    data = build_artifact(read(paths), sources)
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        tmp = "%s.%d.tmp" % (out, os.getpid())
+        with open(tmp, "wb") as f:
+            marshal.dump(data, f)
+        os.replace(tmp, out)
+    except OSError:
+        pass   # Read-only install: still fine, just rebuilt on each start
+    return data
+
+
+def load_engine(paths=(os.path.join(HERE, "taxforms.py"),), artifact=ARTIFACT,
+                cells_path=os.path.join(HERE, "cells.py"), targets=TARGETS, codegen_dir=None):
+    """engine.load(), from the compiled artifact (rebuilt first if stale)."""
+    data = ensure_artifact(list(paths), artifact)
+    ns = dict(PROFILE_DEFAULTS, debug=False)
+    with open(cells_path) as f:
+        exec(compile(f.read(), cells_path, "exec"), ns)
+    exec(data["fns"], ns)
+    cell = ns["cell"]
+    ns["cell_list"] = cell_list = dict(
+        (name, cell(text, line, calc, flag=flag, name=name, form=form))
+        for name, text, line, calc, flag, form in data["nodes"])
+    ns["deps"] = deps = data["deps"]
+    ns["deps_verified"] = True
+    engine = Engine(cell_list, deps, ns, targets, compiled=data["code"])
+    engine.version = source_hash([cells_path] + list(paths) + [PARAMS_PATH])
+    engine.codegen_dir = codegen_dir
+    return engine
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="formc.py",
+                                     description="Compile 1040.js form sources to Python and to a marshal artifact.")
+    parser.add_argument("sources", nargs="+", help="m4 form files, in order, or one generated taxforms.py")
+    parser.add_argument("--py", help="write the taxforms.py equivalent here (- for stdout)")
+    parser.add_argument("-o", "--out", help="write the marshal artifact here, if the sources changed")
+    opts = parser.parse_args(args)
+    try:
+        if opts.py:
+            src = python_source(read(opts.sources))
+            if opts.py == "-": sys.stdout.write(src)
+            else:
+                with open(opts.py, "w") as f: f.write(src)
+        if opts.out:
+            ensure_artifact(opts.sources, opts.out)
+    except FormError as e:
+        parser.exit(1, "formc.py: %s\n" % (e,))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
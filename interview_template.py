@@ -8,6 +8,9 @@
 #status="head of household"
                                  
 
+#Which tax year is this return for? (params.py lists the years it knows.)
+tax_year=2024
+
 #Will you be itemizing deductions?
 itemizing=False
 
@@ -39,5 +42,5 @@ self_emp=False
 # filling in your forms?
 show_optional_zeros=False
 
-# Should I print debugging information?
+# Should I time each calculation and write trace.json for chrome://tracing?
 debug=False
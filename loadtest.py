@@ -0,0 +1,237 @@
+"""Drive the API the way users do, in-process, and time every request.
+
+Each simulated user signs up (or, for users already in the database, signs
+in), answers the /chat interview, answers every /form_chat question and then
+asks /calculate for the result: about 100 requests per user. The users run
+concurrently on one event loop through httpx's ASGI transport, so requests
+reach FastAPI (and its threadpool) exactly as they would from uvicorn, minus
+the sockets.
+
+MongoDB and Stripe are replaced by the local stand-ins below, put into
+sys.modules before main.py is imported, so nothing leaves the machine.
+--mongo-ms adds a delay to each database call to stand in for the network.
+Answers come from bench.py's synthetic households.
+
+    python loadtest.py --users 50 [--concurrency 20] [-o loadtest.json]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import sys
+import threading
+import time
+import types
+from time import perf_counter
+
+from bench import households
+
+mongo_delay = 0.   # seconds added to every stand-in database call
+
+
+class Collection():
+    def __init__(self):
+        self.docs = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def find_one(self, query):
+        time.sleep(mongo_delay)
+        with self.lock:
+            for doc in self.docs:
+                if all(doc.get(k) == v for k, v in query.items()):
+                    return dict(doc)
+        return None
+
+    def insert_one(self, doc):
+        time.sleep(mongo_delay)
+        doc["_id"] = "%024x" % next(self.ids)
+        with self.lock:
+            self.docs.append(dict(doc))
+        return types.SimpleNamespace(inserted_id=doc["_id"])
+
+
+class Database(dict):
+    def __missing__(self, name):
+        return self.setdefault(name, Collection())
+
+
+class MongoClient(dict):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __missing__(self, name):
+        return self.setdefault(name, Database())
+
+
+class PaymentIntent():
+    ids = itertools.count(1)
+
+    @classmethod
+    def create(cls, amount, currency, metadata=None, **kwargs):
+        n = next(cls.ids)
+        return dict(id="pi_%d" % n, amount=amount, currency=currency, metadata=metadata or {},
+                    client_secret="pi_%d_secret_local" % n)
+
+
+def install_stand_ins():
+    """Point `pymongo` and `stripe` at the classes above. Call before importing main."""
+    pymongo = types.ModuleType("pymongo")
+    pymongo.MongoClient = MongoClient
+    stripe = types.ModuleType("stripe")
+    stripe.api_key = None
+    stripe.PaymentIntent = PaymentIntent
+    sys.modules["pymongo"] = pymongo
+    sys.modules["stripe"] = stripe
+
+
+# What the /chat interview calls the filing statuses; it can't say "filing separately".
+API_STATUS = {"single": "single", "married filing jointly": "married",
+              "married filing separately": "married", "head of household": "head_of_household"}
+
+
+def _yes_no(v):
+    return "yes" if v else "no"
+
+
+def chat_reply(field, interview):
+    if field == "status": return API_STATUS[interview["status"]]
+    if field in ("kids", "dependents"): return str(interview[field])
+    return _yes_no(interview.get(field))
+
+
+def form_reply(field, question, interview, inform):
+    if "(yes/no)" in question.lower(): return _yes_no(interview.get("s_loans"))
+    return "%g" % inform.get(field, 0)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values: return 0.
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100. * len(sorted_values) + .5)) - 1))
+    return sorted_values[k]
+
+
+class Recorder():
+    def __init__(self):
+        self.times = dict()    # endpoint -> [seconds]
+        self.errors = dict()   # endpoint -> count
+
+    async def call(self, client, method, path, **kwargs):
+        start = perf_counter()
+        response = await client.request(method, path, **kwargs)
+        self.times.setdefault(path, []).append(perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[path] = self.errors.get(path, 0) + 1
+            raise RuntimeError("%s %s: %d %s" % (method, path, response.status_code, response.text[:200]))
+        return response.json()
+
+    def report(self, seconds, users, failed):
+        endpoints = []
+        for path, times in sorted(self.times.items()):
+            times = sorted(times)
+            endpoints.append(dict(endpoint=path, requests=len(times), errors=self.errors.get(path, 0),
+                                  mean_ms=statistics.fmean(times) * 1e3,
+                                  p50_ms=percentile(times, 50) * 1e3,
+                                  p95_ms=percentile(times, 95) * 1e3,
+                                  p99_ms=percentile(times, 99) * 1e3))
+        requests = sum(e["requests"] for e in endpoints)
+        return dict(users=users, failed_users=failed, seconds=seconds, requests=requests,
+                    requests_per_second=requests / seconds, users_per_second=(users - failed) / seconds,
+                    endpoints=endpoints)
+
+
+async def user_flow(client, rec, k, interview, inform, registered):
+    """One user from sign-in to result. Returns the /calculate results."""
+    from main import QUESTIONS, get_next_question, parse_user_reply
+    from form_fields import FORM_FIELDS
+
+    account = dict(email="user%d@example.com" % k, password="pw%d" % k)
+    if registered:
+        token = (await rec.call(client, "POST", "/signin", json=account))["token"]
+    else:
+        token = (await rec.call(client, "POST", "/signup", json=dict(account, name="User %d" % k)))["token"]
+
+    await rec.call(client, "GET", "/chat", params=dict(token=token))
+    answers = dict()
+    field, _ = QUESTIONS[0]
+    while field:
+        reply = chat_reply(field, interview)
+        await rec.call(client, "GET", "/chat", params=dict(token=token, reply=reply))
+        answers[field] = parse_user_reply(reply)
+        field, _ = get_next_question(answers)   # The server picks the next one the same way
+
+    await rec.call(client, "GET", "/form_chat", params=dict(token=token))
+    for field, question in FORM_FIELDS.items():
+        await rec.call(client, "GET", "/form_chat",
+                       params=dict(token=token, reply=form_reply(field, question, interview, inform)))
+
+    return (await rec.call(client, "POST", "/calculate", params=dict(token=token)))["results"]
+
+
+async def run(users=20, concurrency=None, seed=0, signed_up=0.5):
+    """users simulated users, at most concurrency of them at a time. The
+    first signed_up share of them already have accounts and sign in."""
+    import httpx
+    import main
+
+    registered = int(users * signed_up)
+    for k in range(registered):
+        main.users_collection.insert_one(dict(name="User %d" % k, email="user%d@example.com" % k,
+                                              password="pw%d" % k))
+
+    rec = Recorder()
+    gate = asyncio.Semaphore(concurrency or users)
+    failed = []
+
+    async def one(client, k, interview, inform):
+        async with gate:
+            try:
+                await user_flow(client, rec, k, interview, inform, k < registered)
+            except Exception as e:
+                failed.append((k, str(e)))
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        start = perf_counter()
+        await asyncio.gather(*(one(client, k, interview, inform)
+                               for k, (interview, inform) in enumerate(households(users, seed))))
+        seconds = perf_counter() - start
+    report = rec.report(seconds, users, len(failed))
+    report["failures"] = failed[:10]
+    return report
+
+
+def main(args):
+    global mongo_delay
+    parser = argparse.ArgumentParser(description="Load-test the API in-process with simulated users.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=None, help="users active at once (default: all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--signed-up", type=float, default=0.5, help="share of users who sign in rather than up")
+    parser.add_argument("--mongo-ms", type=float, default=0., help="delay added to each database call")
+    parser.add_argument("-o", "--out", default=None, help="also write the report here as JSON")
+    opts = parser.parse_args(args)
+
+    mongo_delay = opts.mongo_ms / 1000.
+    install_stand_ins()
+    report = asyncio.run(run(opts.users, opts.concurrency, opts.seed, opts.signed_up))
+
+    print("%-20s %8s %6s %9s %9s %9s" % ("endpoint", "requests", "errors", "p50 ms", "p95 ms", "p99 ms"))
+    for e in report["endpoints"]:
+        print("%-20s %8d %6d %9.2f %9.2f %9.2f"
+              % (e["endpoint"], e["requests"], e["errors"], e["p50_ms"], e["p95_ms"], e["p99_ms"]))
+    print("%d users (%d failed), %d requests in %.2f s: %.0f requests/s, %.1f users/s"
+          % (report["users"], report["failed_users"], report["requests"], report["seconds"],
+             report["requests_per_second"], report["users_per_second"]))
+    for k, err in report["failures"]:
+        print("user %d: %s" % (k, err))
+    if opts.out:
+        with open(opts.out, "w") as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
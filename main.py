@@ -1,8 +1,22 @@
 import time
-from fastapi import FastAPI, Query, HTTPException,Header, Depends
+from typing import Optional, List, Dict
+from fastapi import FastAPI, Query, HTTPException,Header, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-import re, os
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
+import re, os, json, codecs, tempfile, threading
+from collections import deque
 from form_fields import FORM_FIELDS
+from engine import profile_from, inputs_from, GraphError
+from formc import load_engine
+from parallel import Pool as BatchPool, safe_summary
+from cache import ResultCache
+from codegen import CACHE_DIR as CODEGEN_DIR
+from sensitivity import marginal_effects
+from optimize import optimize, default_bounds
+from curve import Curves
+from render import FormIndex, RENDERERS, MEDIA_TYPES
+from depgraph import analyze, to_dot
+from metrics import Registry, MetricsMiddleware
 from pydantic import BaseModel, EmailStr, Field
 from pymongo import MongoClient
 from passlib.context import CryptContext
@@ -21,8 +35,24 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-INTERVIEW_FILE = "interview.py"
+# Request counts and latencies per route, read back at /metrics.
+metrics = Registry()
+app.add_middleware(MetricsMiddleware, registry=metrics, routes=app.router.routes)
+
+BATCH_SPOOL_BYTES = 8 << 20   # /calculate_batch uploads beyond this go to a temp file
+BATCH_OBJECT_CHARS = 1 << 20  # and no one return in them may be longer than this
+
+# ---------------- TAX ENGINE ----------------
+# Loaded once at startup from the compiled forms (rebuilt only when taxforms.py
+# changes); /calculate only binds answers and evaluates, with straight-line
+# code per filing profile cached under __pycache__/taxgraph.
+tax_engine = load_engine(codegen_dir=CODEGEN_DIR)
+engine_seconds = metrics.histogram(
+    "tax_engine_compute_seconds", "Time spent evaluating the cell graph", ["op"])
+# Repeat /calculate calls with unchanged answers skip the engine entirely.
+result_cache = ResultCache(tax_engine, timer=engine_seconds.labels("summary"))
+curves = Curves(tax_engine)
+form_index = FormIndex(tax_engine.graph)   # every form's lines, sorted once
 
 # ---------------- QUESTIONS ----------------
 QUESTIONS = [
@@ -43,22 +73,6 @@ user_state = {"step": 0, "answers": {}}
 
 
 # ---------------- UTILITIES ----------------
-def update_interview_file(data: dict):
-    """Save answers to interview.py"""
-    lines = ["# Auto-updated by API\n"]
-    for k, v in data.items():
-        if isinstance(v, str):
-            lines.append(f'{k}="{v}"\n')
-        elif isinstance(v, bool):
-            lines.append(f"{k}={'True' if v else 'False'}\n")
-        else:
-            lines.append(f"{k}={v}\n")
-    lines.append('show_optional_zeros=True\n')
-    lines.append('debug=True\n')
-    with open(INTERVIEW_FILE, "w") as f:
-        f.writelines(lines)
-
-
 def parse_user_reply(reply: str):
     """Simple parser for yes/no/numbers/text."""
     t = reply.strip().lower()
@@ -161,35 +175,52 @@ def get_next_question(answers):
 #     }
 
 
-@app.post("/calculate")
-def calculate_tax():
+class CalculateRequest(BaseModel):
+    interview: Optional[dict] = None   # /chat answers, e.g. {"status": "single", "kids": 0}
+    inform: Optional[dict] = None      # /form_chat answers, e.g. {"f1040_wages": 52000}
+
+
+def get_answers(data: Optional[CalculateRequest], token: Optional[str]):
+    """Interview and form answers from the request body, falling back to the
+    caller's /chat and /form_chat sessions for whatever the body leaves out.
+    A session's answers are only used once that conversation has finished.
+    Form answers that aren't numbers are a 400."""
+    interview = data.interview if data else None
+    inform = data.inform if data else None
+    if interview is None or inform is None:
+        if not token:
+            raise HTTPException(status_code=400, detail="Send interview and inform answers, or a token")
+        email = get_user_from_token(token)
+        if interview is None:
+            session = user_sessions.get(email, {})
+            if not session.get("done"):
+                raise HTTPException(status_code=400, detail="Interview not finished yet; finish /chat first")
+            interview = session["answers"]
+        if inform is None:
+            session = user_form_sessions.get(email, {})
+            if not session.get("done"):
+                raise HTTPException(status_code=400, detail="Form answers not finished yet; finish /form_chat first")
+            inform = session["answers"]
     try:
-        import io, contextlib, importlib
-
-        taxes = importlib.import_module("taxes")
-        interview = importlib.reload(importlib.import_module("interview"))
-        inform = importlib.reload(importlib.import_module("inform"))
-
-        # ✅ Step 1: Load cells.py (defines cell and cell_list)
-        exec(open("cells.py").read(), globals())
+        inform = inputs_from(inform)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return interview, inform
 
-        # ✅ Step 2: Load taxforms.py (depends on cell definitions)
-        exec(open("taxforms.py").read(), globals())
 
-        # ✅ Step 3: Run computations silently
-        output = io.StringIO()
-        with contextlib.redirect_stdout(output):
-            taxes.setup_inform(print_out=False)
-            taxes.cell_list["f1040_refund"].compute()
-            taxes.cell_list["f1040_tax_owed"].compute()
-            taxes.cell_list["f8582_carryover_to_next_year"].compute()
+@app.post("/calculate")
+def calculate_tax(
+    data: Optional[CalculateRequest] = None,
+    token: str = Query(None, description="JWT token; answers come from this user's sessions"),
+):
+    try:
+        # ✅ Step 1: Collect this return's answers
+        interview, inform = get_answers(data, token)
 
-        # ✅ Step 4: Extract only needed final values
-        refund = taxes.cell_list.get("f1040_refund").value if "f1040_refund" in taxes.cell_list else None
-        tax_owed = taxes.cell_list.get("f1040_tax_owed").value if "f1040_tax_owed" in taxes.cell_list else None
-        carryover = taxes.cell_list.get("f8582_carryover_to_next_year").value if "f8582_carryover_to_next_year" in taxes.cell_list else None
+        # ✅ Step 2: Evaluate on the preloaded engine
+        results = result_cache.summary(interview, inform)
 
-        # ✅ Step 5: Return only summarized results — no internal logs
+        # ✅ Step 3: Return only summarized results — no internal logs
         return {
             "message": "Tax calculation completed successfully ✅",
             "note": (
@@ -198,18 +229,285 @@ def calculate_tax():
         "- A positive tax owed means you still need to pay that amount.\n"
         "- 'Carryover to next year' represents losses or credits that can reduce next year's taxes."
     ),
-           "results": {
-        "refund": round(refund or 0, 2),
-        "tax_owed": round(tax_owed or 0, 2),
-        "carryover_to_next_year": round(carryover or 0, 2)
-    }
+           "results": results
         }
 
+    except HTTPException:
+        raise
+    except (GraphError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         import traceback
         print("ERROR DETAILS:\n", traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+
+class SensitivityRequest(CalculateRequest):
+    inputs: Optional[List[str]] = None   # input cells to vary; all of them if left out
+
+
+@app.post("/sensitivity")
+def sensitivity(
+    data: Optional[SensitivityRequest] = None,
+    token: str = Query(None, description="JWT token; answers come from this user's sessions"),
+    delta: float = Query(100, description="How much to add to each input"),
+    parallel: bool = Query(False, description="Spread the inputs over a pool of worker processes"),
+):
+    """The marginal-rate table: for each input, how refund and tax owed move
+    when it goes up by delta."""
+    interview, inform = get_answers(data, token)
+    names = data.inputs if data else None
+    try:
+        profile = profile_from(interview)
+        with engine_seconds.labels("sensitivity").time():
+            if parallel:
+                rows = get_batch_pool().marginal_effects(interview, inform, delta, names)
+            else:
+                rows = marginal_effects(tax_engine, profile, inform, delta, names)
+    except (GraphError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"delta": delta, "effects": rows}
+
+
+class OptimizeRequest(CalculateRequest):
+    bounds: Optional[Dict[str, List[float]]] = None   # input cell -> [low, high]; IRA/HSA limits if left out
+
+
+@app.post("/optimize")
+def optimize_levers(
+    data: Optional[OptimizeRequest] = None,
+    token: str = Query(None, description="JWT token; answers come from this user's sessions"),
+):
+    """The IRA, HSA and charity amounts (or any inputs given bounds) that
+    minimize tax owed minus refund, and whether to itemize."""
+    interview, inform = get_answers(data, token)
+    try:
+        profile = profile_from(interview)
+        bounds = default_bounds(profile, inform)
+        if data and data.bounds:
+            for name, span in data.bounds.items():
+                if len(span) != 2: raise ValueError("%s: bounds are [low, high]" % (name,))
+                bounds[name] = tuple(span)
+        with engine_seconds.labels("optimize").time():
+            return optimize(tax_engine, profile, inform, bounds)
+    except (GraphError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+class CurveRequest(CalculateRequest):
+    input: str = "f1040_wages"   # the input cell to vary
+    low: float = 0
+    high: float = 500000
+
+
+@app.post("/curve")
+def tax_curve(
+    data: Optional[CurveRequest] = None,
+    token: str = Query(None, description="JWT token; answers come from this user's sessions"),
+):
+    """Refund and tax owed as piecewise-linear functions of one input from
+    low to high, the others as answered: breakpoints and slopes, for plotting."""
+    interview, inform = get_answers(data, token)
+    data = data or CurveRequest()
+    try:
+        with engine_seconds.labels("curve").time():
+            return curves.curve(profile_from(interview), inform, data.input, data.low, data.high)
+    except (GraphError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/return")
+def full_return(
+    data: Optional[CalculateRequest] = None,
+    token: str = Query(None, description="JWT token; answers come from this user's sessions"),
+    format: str = Query("json", description="json, ndjson, csv or text"),
+    show_optional_zeros: Optional[bool] = Query(None, description="Include optional lines left at zero; "
+                                                                  "defaults to the interview's answer"),
+):
+    """Every line of every form the interview calls for, streamed form by form."""
+    if format not in RENDERERS:
+        raise HTTPException(status_code=400, detail="format must be one of: %s" % ", ".join(sorted(RENDERERS)))
+    interview, inform = get_answers(data, token)
+    if show_optional_zeros is None:
+        show_optional_zeros = str(interview.get("show_optional_zeros", "")).strip().lower() in ("yes", "y", "true")
+    try:
+        profile = profile_from(interview)
+        with engine_seconds.labels("return").time():
+            values = tax_engine.evaluate(profile, inform)
+    except (GraphError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(RENDERERS[format](form_index, values, profile, show_optional_zeros),
+                             media_type=MEDIA_TYPES[format])
+
+
+def iter_json_objects(chunks, max_object=BATCH_OBJECT_CHARS):
+    """Yield the objects of an NDJSON body or of a JSON array body one at a time,
+    holding at most one object's worth of unparsed text. Something that isn't
+    an object, doesn't parse, or runs past max_object characters is yielded
+    as a ValueError in its place, and reading resumes at the next line."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    skipping = False   # Dropping the rest of a bad line
+    for chunk in chunks:
+        buf += utf8.decode(chunk)
+        pos = 0
+        while True:
+            if skipping:
+                pos = buf.find("\n", pos)
+                if pos < 0:
+                    pos = len(buf)
+                    break
+                skipping = False
+            while pos < len(buf) and buf[pos] in " \t\r\n,[]":
+                pos += 1
+            if pos == len(buf):
+                break
+            if buf[pos] != "{":
+                yield ValueError("Expected a JSON object at %r" % (buf[pos:pos+20].partition("\n")[0],))
+                skipping = True
+                continue
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if buf.find("\n", e.pos) >= 0:   # Not just cut off by the chunk: bad
+                    yield ValueError("Bad JSON object at %r: %s" % (buf[pos:pos+20].partition("\n")[0], e.msg))
+                    pos = e.pos
+                    skipping = True
+                    continue
+                if len(buf) - pos > max_object:
+                    yield ValueError("JSON object at %r is over %d characters" % (buf[pos:pos+20].partition("\n")[0], max_object))
+                    pos = len(buf)
+                    skipping = True
+                break   # Incomplete: wait for the next chunk
+            yield obj
+        buf = buf[pos:]
+    if not skipping and buf.strip(" \t\r\n,[]"):
+        yield ValueError("Truncated JSON object at end of body")
+
+
+def batch_return(item):
+    """(interview, inform) from one /calculate_batch object; ValueError if
+    either isn't what /calculate takes."""
+    if isinstance(item, ValueError): raise item
+    interview = item.get("interview") or {}
+    if not isinstance(interview, dict):
+        raise ValueError("interview must be an object of answers, not %r" % (interview,))
+    return interview, inputs_from(item.get("inform") or {})
+
+
+def timed_summary(interview, inform):
+    with engine_seconds.labels("batch").time():
+        return safe_summary(tax_engine, interview, inform)
+
+
+batch_pool = None
+batch_pool_lock = threading.Lock()
+def get_batch_pool():
+    """Worker processes for /calculate_batch?parallel=true, started on first use.
+    Forking this threaded server could copy a lock some other thread holds,
+    so workers come from a forkserver instead."""
+    global batch_pool
+    with batch_pool_lock:
+        if batch_pool is None:
+            batch_pool = BatchPool(start_method="forkserver")
+    return batch_pool
+
+
+@app.post("/calculate_batch")
+async def calculate_batch(
+    request: Request,
+    parallel: bool = Query(False, description="Spread the batch over a pool of worker processes"),
+):
+    """Many returns in one request: the body is NDJSON or a JSON array of
+    {"interview": {...}, "inform": {...}} objects. Answers stream back as NDJSON,
+    one line per return in input order, as each is computed. A return that
+    can't be read gets {"index": i, "error": ...} and the rest still run."""
+    # Spool the upload before answering: the response can't read the request
+    # body while it streams, since Starlette is then listening for a disconnect.
+    body = tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_BYTES)
+    async for chunk in request.stream():
+        body.write(chunk)
+    body.seek(0)
+
+    def results():
+        # One entry per object read, in order: None for a return sent on to be
+        # computed, or the error for one that couldn't be read.
+        read = deque()
+        def returns():
+            for item in iter_json_objects(iter(lambda: body.read(65536), b"")):
+                try:
+                    r = batch_return(item)
+                except ValueError as e:
+                    read.append(str(e))
+                    continue
+                read.append(None)
+                yield r
+        if parallel:
+            summaries = get_batch_pool().map(returns())
+        else:
+            summaries = (timed_summary(*r) for r in returns())
+        i = 0
+        try:
+            for summary in summaries:
+                while read[0] is not None:
+                    yield json.dumps({"index": i, "error": read.popleft()}) + "\n"
+                    i += 1
+                read.popleft()
+                yield json.dumps({"index": i, **summary}) + "\n"
+                i += 1
+            for error in read:
+                yield json.dumps({"index": i, "error": error}) + "\n"
+                i += 1
+        finally:
+            body.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+metrics.callback("tax_result_cache_hit_ratio", "Share of /calculate lookups answered from the cache",
+                 lambda: result_cache.stats()["hit_ratio"])
+metrics.callback("tax_result_cache_hits_total", "/calculate lookups answered from the cache",
+                 lambda: result_cache.stats()["hits"], kind="counter")
+metrics.callback("tax_result_cache_misses_total", "/calculate lookups that ran the engine",
+                 lambda: result_cache.stats()["misses"], kind="counter")
+metrics.callback("tax_result_cache_size", "Results held in the cache",
+                 lambda: result_cache.stats()["size"])
+metrics.callback("tax_user_sessions", "/chat sessions held in memory",
+                 lambda: len(user_sessions))
+metrics.callback("tax_user_form_sessions", "/form_chat sessions held in memory",
+                 lambda: len(user_form_sessions))
+
+
+# The graph is fixed once the server is up, so each report is built once.
+GRAPH_FORMATS = dict(json=("application/json", lambda: json.dumps(analyze(tax_engine))),
+                     dot=("text/vnd.graphviz", lambda: "".join(to_dot(tax_engine))))
+graph_reports = dict()
+
+@app.get("/graph")
+def graph_report(
+    request: Request,
+    format: str = Query("json", description="json (depth, fan-in/out, longest chains, form sizes) or dot"),
+):
+    """The shape of the cell graph. Sent with an ETag of the forms' version,
+    so clients can revalidate instead of downloading it again."""
+    if format not in GRAPH_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be json or dot")
+    etag = '"%s-%s"' % (tax_engine.version, format)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=3600"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    media_type, build = GRAPH_FORMATS[format]
+    if format not in graph_reports:
+        graph_reports[format] = build()
+    return Response(graph_reports[format], media_type=media_type, headers=headers)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Everything above, in the Prometheus text exposition format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 form_state = {"step": 0, "answers": {}}
 def get_section_title(field_key: str):
     """Detect schedule/section title from field name"""
@@ -244,17 +542,6 @@ def get_section_title(field_key: str):
         return "👶 Schedule 8812 - Child Tax Credit"
     return "📄 General Information"
 
-def update_form_file(data: dict):
-    """Write all form fields to inform.py"""
-    lines = ["# Auto-generated IRS form data\n"]
-    for k, v in data.items():
-        if isinstance(v, str) and not v.replace('.', '', 1).isdigit():
-            lines.append(f'{k}="{v}"\n')
-        else:
-            lines.append(f"{k}={v}\n")
-    with open("inform.py", "w") as f:
-        f.writelines(lines)
-
 # @app.get("/form_chat")
 # def form_chat(reply: str = Query(None, description="User reply text")):
 #     global form_state
@@ -521,7 +808,7 @@ def chat_with_user(
 ):
     # Initialize user session if not exist
     if email not in user_sessions:
-        user_sessions[email] = {"step": 0, "answers": {}}
+        user_sessions[email] = {"step": 0, "answers": {}, "done": False}
 
     user_state = user_sessions[email]
 
@@ -529,6 +816,7 @@ def chat_with_user(
     if reply is None:
         user_state["step"] = 0
         user_state["answers"] = {}
+        user_state["done"] = False
         first_field, first_q = QUESTIONS[0]
         greeting = f"👋 Hi! I’m your Tax Filing Assistant.\n\n"
         return {"bot": f"{greeting}{first_q}"}
@@ -571,8 +859,8 @@ def chat_with_user(
 
         return {"bot": next_q, "collected": user_state["answers"]}
 
-    # End of form
-    update_interview_file(user_state["answers"])
+    # End of form: answers stay in this user's session for /calculate
+    user_state["done"] = True
     return {
         "bot": f"✅ Thanks {email}! All your answers have been recorded successfully.",
         "final_data": user_state["answers"]
@@ -589,7 +877,7 @@ def form_chat(
 
     # 🧠 Each user has their own form_state
     if user_email not in user_form_sessions:
-        user_form_sessions[user_email] = {"step": 0, "answers": {}}
+        user_form_sessions[user_email] = {"step": 0, "answers": {}, "done": False}
 
     form_state = user_form_sessions[user_email]
     field_names = list(FORM_FIELDS.keys())
@@ -673,8 +961,8 @@ def form_chat(
             response["transition"] = transition_message
         return response
 
-    # ✅ All done
-    update_form_file(form_state["answers"])
+    # ✅ All done: answers stay in this user's session for /calculate
+    form_state["done"] = True
     return {
         "bot": f"🎉 All values collected and saved successfully!",
         "final_data": form_state["answers"],
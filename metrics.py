@@ -0,0 +1,238 @@
+"""In-process request and engine metrics, served in the Prometheus text format.
+
+Nothing here takes a lock on the request path. Counts are itertools.count
+objects: next() on one is a single C call, so it is atomic under the GIL and
+threads never wait on each other. Sums of seconds can't be counted that way,
+so each thread adds into a slot of its own and a scrape adds the slots up.
+A scrape may see one request's count before its sum; Prometheus tolerates that.
+
+    registry = Registry()
+    calls = registry.counter("calls_total", "Calls made", ["kind"])
+    calls.labels("a").inc()
+    print(registry.render())
+"""
+
+import itertools
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from starlette.routing import Match
+
+# Seconds; the engine answers in well under a millisecond, Mongo in tens of them.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+def _peek(count):
+    """The value an itertools.count would return next, without taking it."""
+    return int(repr(count)[6:-1])
+
+
+class _Sum():
+    """A float total that many threads add to without a lock."""
+    def __init__(self):
+        self.local = threading.local()
+        self.slots = []
+
+    def add(self, x):
+        try:
+            slot = self.local.slot
+        except AttributeError:
+            slot = self.local.slot = [0.]
+            self.slots.append(slot)
+        slot[0] += x
+
+    def value(self):
+        return sum(s[0] for s in list(self.slots))
+
+
+class Counter():
+    def __init__(self):
+        self.count = itertools.count()
+
+    def inc(self):
+        next(self.count)
+
+    def value(self):
+        return _peek(self.count)
+
+
+class Gauge():
+    """Goes up and down: two counts, and the value is their difference."""
+    def __init__(self):
+        self.up = itertools.count()
+        self.down = itertools.count()
+
+    def inc(self):
+        next(self.up)
+
+    def dec(self):
+        next(self.down)
+
+    def value(self):
+        return _peek(self.up) - _peek(self.down)
+
+
+class Histogram():
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [itertools.count() for _ in range(len(self.buckets) + 1)]
+        self.sum = _Sum()
+
+    def observe(self, x):
+        next(self.counts[bisect_left(self.buckets, x)])
+        self.sum.add(x)
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer():
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.start)
+
+
+class Family():
+    """One metric name, and a child per combination of label values."""
+    def __init__(self, kind, name, help, labels, make):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.make = make
+        self.children = dict()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            # setdefault is atomic, so two threads racing here share one child.
+            child = self.children.setdefault(values, self.make())
+        return child
+
+    # Unlabelled metrics are used directly.
+    def inc(self): self.labels().inc()
+    def dec(self): self.labels().dec()
+    def observe(self, x): self.labels().observe(x)
+    def time(self): return self.labels().time()
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.label_names, values)) + list(extra)
+        if not pairs: return ""
+        return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in pairs)
+
+    def samples(self):
+        for values, child in sorted(self.children.items()):
+            if self.kind != "histogram":
+                yield self.name + self._label_text(values), child.value()
+                continue
+            total = 0
+            for le, count in zip(child.buckets + ("+Inf",), child.counts):
+                total += _peek(count)
+                le = le if isinstance(le, str) else repr(float(le))
+                yield self.name + "_bucket" + self._label_text(values, [("le", le)]), total
+            yield self.name + "_sum" + self._label_text(values), child.sum.value()
+            yield self.name + "_count" + self._label_text(values), total
+
+
+class _Callback():
+    """A value read from the application at scrape time, e.g. a dict's size."""
+    def __init__(self, fn):
+        self.fn = fn
+
+    def value(self):
+        return self.fn()
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(v):
+    if v != v: return "NaN"
+    if isinstance(v, int) or float(v).is_integer(): return "%d" % v
+    return repr(float(v))
+
+
+class Registry():
+    def __init__(self):
+        self.families = []
+
+    def _add(self, kind, name, help, labels, make):
+        f = Family(kind, name, help, labels, make)
+        self.families.append(f)
+        return f
+
+    def counter(self, name, help, labels=()):
+        return self._add("counter", name, help, labels, Counter)
+
+    def gauge(self, name, help, labels=()):
+        return self._add("gauge", name, help, labels, Gauge)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add("histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def callback(self, name, help, fn, kind="gauge"):
+        """A metric whose value is fn(), called on each scrape."""
+        f = self._add(kind, name, help, (), lambda: _Callback(fn))
+        f.labels()
+        return f
+
+    def render(self):
+        lines = []
+        for f in self.families:
+            lines.append("# HELP %s %s" % (f.name, f.help))
+            lines.append("# TYPE %s %s" % (f.name, f.kind))
+            for name, value in f.samples():
+                lines.append("%s %s" % (name, _number(value)))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware():
+    """ASGI middleware timing every HTTP request by route template, from the
+    request arriving until the last byte of the response is sent (so a
+    streamed response counts in full)."""
+    def __init__(self, app, registry, routes):
+        self.app = app
+        self.routes = routes
+        self.in_flight = registry.gauge(
+            "http_requests_in_flight", "Requests being handled", ["method", "route"])
+        self.requests = registry.counter(
+            "http_requests_total", "Requests handled", ["method", "route", "status"])
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "Time to handle a request", ["method", "route"])
+
+    def route_of(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL: return route.path
+        # Unknown paths share one label, so scanners can't grow the series.
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        key = (scope["method"], self.route_of(scope))
+        status = ["500"]
+
+        async def send_and_watch(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        in_flight = self.in_flight.labels(*key)
+        in_flight.inc()
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_and_watch)
+        finally:
+            self.latency.labels(*key).observe(perf_counter() - start)
+            in_flight.dec()
+            self.requests.labels(*(key + (status[0],))).inc()
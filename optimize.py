@@ -0,0 +1,190 @@
+"""Choose IRA, HSA and charity amounts that minimize tax owed minus refund.
+
+Each lever moves between a low and a high bound. The search is coordinate
+descent: one lever at a time, the others held where they are, until a round
+changes nothing. Along one lever the bottom line is piecewise linear (sums,
+max/min, IF and the bracket tables), so its lowest point is at an end or at a
+kink. Kinks are found by intersecting the lines through the two ends of an
+interval: if there is only one, the intersection is the kink, confirmed by
+the value and the slopes on either side of it; if not, the interval is split
+there and each half searched the same way. Every evaluation starts from the current values and re-runs only
+the cells downstream of the lever (Plan.downstream), as sensitivity.py does.
+
+Below $100,000 of taxable income the tax comes from $50 table rows, which
+turns the lines into staircases. Slopes are measured over one row (`width`)
+and lines need only agree to within `tol`, so the steps read as the bracket
+rate; answers are exact to within one table row.
+
+Standard or itemized: f1040_deductions already takes the larger, and with
+every input live (as here) Schedule A counts whatever the interview said, so
+the search settles whichever way is cheaper and the result reports which.
+
+From the command line: python taxes.py optimize [--bound NAME=LOW:HIGH ...]
+reads interview.py and inform.py like taxes.py does.
+"""
+
+import argparse
+import json
+import sys
+
+from engine import GraphError, load, read_answers, profile_from
+from params import params
+
+IRA = "f1040sch1_ira_deduction"
+HSA = "f1040sch1_hsa_deduction"
+CHARITY = "f1040_sched_a_charity_cash"
+LEVERS = (IRA, HSA, CHARITY)
+
+
+def default_bounds(profile, inputs):
+    """The year's contribution limits for the IRA (each spouse, with the
+    catch-up for those over 65; the catch-up starts at 50, but the interview
+    only asks about 65, so filers of 50 to 64 should give their own bound)
+    and the HSA (family coverage for joint filers). Charity has no natural
+    limit, so it stays at what was entered."""
+    limits = params(profile["tax_year"]).limits
+    joint = profile["status"] == "married filing jointly"
+    older = profile["over_65"] + (joint and profile["spouse_over_65"])
+    ira = limits["ira"] * (2 if joint else 1) + limits["ira_catch_up"] * older
+    hsa = limits["hsa_family"] if joint else limits["hsa_self"]
+    charity = inputs.get(CHARITY, 0) or 0
+    return {IRA: (0, ira), HSA: (0, hsa), CHARITY: (charity, charity)}
+
+
+class _Objective():
+    """Tax owed minus refund at the current values with one input changed."""
+    def __init__(self, engine, plan, values):
+        self.plan = plan
+        self.values = values
+        self.slots = dict(plan.inputs)
+        self.refund = engine.slots["f1040_refund"]
+        self.owed = engine.slots["f1040_tax_owed"]
+        self.evaluations = 0
+
+    def score(self, v):
+        return (v[self.owed] or 0) - (v[self.refund] or 0)
+
+    def moved(self, name, x):
+        v = self.values[:]
+        v[self.slots[name]] = x
+        for i, fn in self.plan.downstream(name):
+            v[i] = fn(v)
+        self.evaluations += 1
+        return v
+
+    def at(self, name, x):
+        return self.score(self.moved(name, x))
+
+
+def minimize_line(f, lo, hi, width=50., tol=25.):
+    """(x, f(x)) with the lowest f(x) over whole dollars in [lo, hi], for a
+    piecewise-linear f. Ties go to the smaller x."""
+    seen = dict()
+    def at(x):
+        x = min(max(round(x), lo), hi)
+        if x not in seen: seen[x] = f(x)
+        return seen[x]
+
+    if hi - lo > 2*width:
+        stack = [(lo, at(lo), (at(lo + width) - at(lo))/width,
+                  hi, at(hi), (at(hi) - at(hi - width))/width)]
+    else:
+        stack = []
+        for x in range(int(lo), int(hi) + 1, max(1, int(width/5))):
+            at(x)
+        at(hi)
+    while stack:
+        a, fa, sa, b, fb, sb = stack.pop()
+        if b - a <= 2*width: continue
+        if abs(fa + sa*(b - a) - fb) <= tol and abs(fb - sb*(b - a) - fa) <= tol: continue   # One line
+        x = (fb - fa + sa*a - sb*b)/(sa - sb) if sa != sb else (a + b)/2
+        if not a + width <= x <= b - width: x = (a + b)/2
+        x = round(x)
+        fx = at(x)
+        sl, sr = (fx - at(x - width))/width, (at(x + width) - fx)/width
+        if (abs(fx - (fa + sa*(x - a))) <= tol and abs(fx - (fb - sb*(b - x))) <= tol
+                and abs(fx - sl*(x - a) - fa) <= tol and abs(fx + sr*(b - x) - fb) <= tol):
+            continue   # x is the only kink: both lines run into it
+        stack.append((a, fa, sa, x, fx, sl))
+        stack.append((x, fx, sr, b, fb, sb))
+    return min(seen.items(), key=lambda kv: (round(kv[1], 2), kv[0]))
+
+
+def optimize(engine, profile, inputs, bounds=None, rounds=5):
+    """Search the levers in `bounds` (input cell -> (low, high); default
+    default_bounds()) for the lowest tax owed minus refund. Returns the
+    chosen amounts and what they do to the return."""
+    if bounds is None: bounds = default_bounds(profile, inputs)
+    plan = engine.plan_for(profile, prune=False)   # every input stays live
+    slots = dict(plan.inputs)
+    for name, (lo, hi) in bounds.items():
+        if name not in slots: raise GraphError("%s is not an input cell" % (name,))
+        if lo > hi: raise GraphError("%s: low bound %g is above high bound %g" % (name, lo, hi))
+
+    start = dict(inputs)
+    for name, (lo, hi) in bounds.items():
+        start[name] = min(max(inputs.get(name, 0) or 0, lo), hi)
+    obj = _Objective(engine, plan, plan.evaluate(start))
+    base = obj.score(plan.evaluate(inputs))
+    current = obj.score(obj.values)
+
+    for k in range(rounds):
+        improved = False
+        for name, (lo, hi) in bounds.items():
+            if lo == hi: continue
+            x, fx = minimize_line(lambda x: obj.at(name, x), lo, hi)
+            if fx < current - 0.005 and x != obj.values[slots[name]]:
+                obj.values = obj.moved(name, x)
+                current = obj.score(obj.values)
+                improved = True
+        if not improved: break
+
+    v = obj.values
+    std = v[engine.slots["f1040_std_deduction"]] or 0
+    itemized = v[engine.slots["f1040_sched_a_total_itemized_deductions"]] or 0
+    return dict(levers=[dict(input=name, value=v[slots[name]], was=inputs.get(name, 0) or 0,
+                             low=lo, high=hi) for name, (lo, hi) in bounds.items()],
+                refund=round(v[engine.slots["f1040_refund"]] or 0, 2),
+                tax_owed=round(v[engine.slots["f1040_tax_owed"]] or 0, 2),
+                change=round(current - base, 2),
+                itemize=itemized > std, deduction=max(std, itemized),
+                rounds=k + 1, evaluations=obj.evaluations)
+
+
+def _bound(text):
+    name, _, span = text.partition("=")
+    lo, _, hi = span.partition(":")
+    try:
+        return name, (float(lo), float(hi or lo))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected NAME=LOW:HIGH, got %r" % (text,))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="taxes.py optimize",
+                                     description="Pick IRA, HSA and charity amounts that minimize tax owed minus refund.")
+    parser.add_argument("--bound", type=_bound, action="append", default=[], metavar="NAME=LOW:HIGH",
+                        help="range for a lever; repeat for more (default: IRA and HSA limits)")
+    parser.add_argument("--interview", default="interview.py")
+    parser.add_argument("--inform", default="inform.py")
+    parser.add_argument("--json", action="store_true")
+    opts = parser.parse_args(args)
+
+    interview, inform = read_answers(opts.interview), read_answers(opts.inform)
+    try:
+        profile = profile_from(interview)
+        bounds = default_bounds(profile, inform)
+        bounds.update(opts.bound)
+        result = optimize(load(), profile, inform, bounds)
+    except (GraphError, ValueError) as e:
+        parser.error(str(e))
+
+    if opts.json:
+        sys.stdout.write(json.dumps(result) + "\n")
+        return
+    for lever in result["levers"]:
+        print("%-30s %10g  (was %g; range %g to %g)"
+              % (lever["input"], lever["value"], lever["was"], lever["low"], lever["high"]))
+    print("%s deduction of %g" % ("Itemized" if result["itemize"] else "Standard", result["deduction"]))
+    print("Refund %.2f, tax owed %.2f: %+.2f against the return as entered (%d evaluations)"
+          % (result["refund"], result["tax_owed"], result["change"], result["evaluations"]))
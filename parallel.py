@@ -0,0 +1,146 @@
+"""Spread a batch of returns over a pool of worker processes.
+
+The engine is pure Python and holds the GIL, so one process uses one core no
+matter how many threads call it. Each worker here loads and compiles the forms
+once, in its initializer, and then takes returns in chunks so the pickling cost
+is paid per chunk rather than per return. Results come back in input order.
+
+From the command line: python taxes.py batch returns.ndjson [-o out.ndjson]
+where each input line is {"interview": {...}, "inform": {...}}.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from codegen import CACHE_DIR as CODEGEN_DIR
+from engine import load, profile_from, HERE
+from sensitivity import marginal_effects
+
+_engine = None   # One per worker process
+
+
+def _init_worker(forms_path, cells_path):
+    global _engine
+    _engine = load(forms_path, cells_path, codegen_dir=CODEGEN_DIR)
+
+
+def safe_summary(engine, interview, inform):
+    """engine.summary(), with a failure reported in the result rather than
+    raised, so one bad return doesn't sink its batch."""
+    try:
+        return engine.summary(interview, inform)
+    except Exception as e:
+        return dict(error=str(e))
+
+
+def _calc_chunk(chunk):
+    return [safe_summary(_engine, interview, inform) for interview, inform in chunk]
+
+
+def _input_names():
+    return [name for name, _ in _engine.inputs]
+
+
+def _sensitivity_chunk(interview, inform, delta, names):
+    return marginal_effects(_engine, profile_from(interview), inform, delta, names)
+
+
+def _chunks(returns, size):
+    chunk = []
+    try:
+        for r in returns:
+            chunk.append(r)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+    except Exception:
+        if chunk: yield chunk   # What was read before the input failed still counts
+        raise
+    if chunk: yield chunk
+
+
+def _context(start_method=None):
+    # Fork where we can, unless told otherwise: spawned workers would re-run
+    # the calling script (taxes.py does all its work at the top level). A
+    # threaded server must not fork, and asks for forkserver instead.
+    if (start_method or "fork") in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context(start_method or "fork")
+    return multiprocessing.get_context()
+
+
+class Pool():
+    def __init__(self, workers=None, chunksize=256,
+                 forms_path=os.path.join(HERE, "taxforms.py"), cells_path=os.path.join(HERE, "cells.py"),
+                 start_method=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=_context(start_method),
+                                            initializer=_init_worker,
+                                            initargs=(forms_path, cells_path))
+
+    def map(self, returns):
+        """returns: iterable of (interview, inform) pairs. Yields one summary
+        dict per return, in order. Only a few chunks per worker are in flight
+        at a time, so the input can be a generator of any length. If reading
+        the input raises (a malformed line), every return read before it is
+        still yielded, then the error is raised, as a plain loop would."""
+        pending = deque()
+        try:
+            for chunk in _chunks(returns, self.chunksize):
+                pending.append(self.executor.submit(_calc_chunk, chunk))
+                if len(pending) >= 2*self.workers:
+                    yield from pending.popleft().result()
+        except Exception:
+            while pending:
+                yield from pending.popleft().result()
+            raise
+        while pending:
+            yield from pending.popleft().result()
+
+    def marginal_effects(self, interview, inform, delta=100, names=None):
+        """sensitivity.marginal_effects() for one return, with the inputs
+        split evenly across the workers. Rows come back in input order."""
+        if names is None:
+            names = self.executor.submit(_input_names).result()
+        size = -(-len(names) // self.workers) or 1
+        futures = [self.executor.submit(_sensitivity_chunk, interview, inform, delta, chunk)
+                   for chunk in _chunks(names, size)]
+        return [row for f in futures for row in f.result()]
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def calculate_many(returns, workers=None, chunksize=256):
+    """One-off batch: start a pool, run every return through it, shut it down."""
+    with Pool(workers, chunksize) as pool:
+        yield from pool.map(returns)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="taxes.py batch",
+                                     description="Calculate many returns across all cores.")
+    parser.add_argument("infile", help="NDJSON, one {\"interview\": ..., \"inform\": ...} per line; - for stdin")
+    parser.add_argument("-o", "--out", default="-", help="where to write NDJSON results (default stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=256)
+    opts = parser.parse_args(args)
+
+    infile = sys.stdin if opts.infile == "-" else open(opts.infile)
+    out = sys.stdout if opts.out == "-" else open(opts.out, "w")
+    returns = ((r.get("interview") or {}, r.get("inform") or {})
+               for r in (json.loads(line) for line in infile if line.strip()))
+    for i, result in enumerate(calculate_many(returns, opts.workers, opts.chunksize)):
+        out.write(json.dumps(dict(index=i, **result)) + "\n")
+    out.flush()
@@ -0,0 +1,130 @@
+"""Tax parameters by year: brackets, standard deductions, EITC, AMT and CTC,
+plus the IRA and HSA contribution limits.
+
+Each year is one table in YEARS, written as the IRS publishes it. On first use
+a year is laid out in flat lookup arrays, indexed by filing status, and kept,
+so the helpers in taxforms.py do an index or a bisect instead of walking an
+if-chain.
+
+The year a return is figured under is the `tax_year` interview answer (see
+engine.PROFILE_DEFAULTS); the helpers read it like fstatus() reads `status`,
+or take an explicit year. Since it is part of the profile, returns for
+different years can sit in one batch, or the same returns can be run under
+each year in turn (batch.BatchEngine.compare_years) with nothing reloaded.
+"""
+
+from array import array
+
+DEFAULT_YEAR = 2024
+
+STATUSES = ("single", "married filing separately", "married filing jointly", "head of household")
+STATUS_INDEX = dict((s, i) for i, s in enumerate(STATUSES))
+
+# Most people 65 or over a return can count: the two spouses, plus blindness.
+MAX_OVER65 = 4
+
+YEARS = {
+    2023: dict(
+        rates=[0.1, 0.12, 0.22, 0.24, 0.32, 0.35, 0.37],
+        brackets={
+            "single":                    [0, 11000, 44725, 95375, 182100, 231250, 578125],
+            "married filing separately": [0, 11000, 44725, 95375, 182100, 231250, 346875],
+            "married filing jointly":    [0, 22000, 89450, 190750, 364200, 462500, 693750],
+            "head of household":         [0, 15700, 59850, 95350, 182100, 231250, 578100],
+        },
+        # By how many of the filers are 65 or over.
+        std_deduction={
+            "single":                    [13850, 15700, 17550],
+            "married filing separately": [13850, 15350, 16850, 18350, 19850],
+            "married filing jointly":    [27700, 29200, 30700, 32200, 33700],
+            "head of household":         [20800, 22650, 24500],
+        },
+        # By kids (0-3): plateau start, plateau value, plateau end, zero point,
+        # then the phaseout start and zero point for married filing jointly.
+        eitc=[[7840, 600, 9800, 17640, 16370, 24210],
+              [11750, 3995, 21560, 46560, 28120, 53120],
+              [16510, 6604, 21560, 52918, 28120, 59478],
+              [16510, 7430, 21560, 56838, 28120, 63398]],
+        # Exemption, the income it stops at, where the 28% rate starts, the
+        # amount subtracted from the tentative AMT.
+        amt={
+            "single":                    [81300, 578150, 220700, 4414],
+            "married filing separately": [63250, 578150, 110350, 2207],
+            "married filing jointly":    [126500, 1156300, 220700, 4414],
+            "head of household":         [81300, 578150, 220700, 4414],
+        },
+        ctc_phaseout={"single": 200000, "married filing separately": 200000,
+                      "married filing jointly": 400000, "head of household": 200000},
+        # Contribution limits, per person; the optimizer's default bounds.
+        limits=dict(ira=6500, ira_catch_up=1000, hsa_self=3850, hsa_family=7750),
+    ),
+    2024: dict(
+        rates=[0.1, 0.12, 0.22, 0.24, 0.32, 0.35, 0.37],
+        brackets={
+            "single":                    [0, 11600, 47150, 100525, 191950, 243725, 609350],
+            "married filing separately": [0, 11600, 47150, 100525, 191950, 243725, 365600],
+            "married filing jointly":    [0, 23200, 94300, 201050, 383900, 487450, 731200],
+            "head of household":         [0, 16550, 63100, 100500, 191950, 243700, 609350],
+        },
+        std_deduction={
+            "single":                    [14600, 16550, 18500],
+            "married filing separately": [14600, 16150, 17700, 19250, 20800],
+            "married filing jointly":    [29200, 30750, 32300, 33850, 35400],
+            "head of household":         [21900, 23850, 25800],
+        },
+        eitc=[[8260, 632, 10330, 18591, 17250, 25511],
+              [12390, 4213, 22720, 49084, 29640, 56004],
+              [17400, 6960, 22720, 55768, 29640, 62688],
+              [17400, 7830, 22720, 59899, 29640, 66819]],
+        amt={
+            "single":                    [85700, 609350, 232600, 4652],
+            "married filing separately": [66650, 609350, 116300, 2326],
+            "married filing jointly":    [133300, 1218700, 232600, 4652],
+            "head of household":         [85700, 609350, 232600, 4652],
+        },
+        ctc_phaseout={"single": 200000, "married filing separately": 200000,
+                      "married filing jointly": 400000, "head of household": 200000},
+        limits=dict(ira=7000, ira_catch_up=1000, hsa_self=4150, hsa_family=8300),
+    ),
+}
+
+
+def bracket_table(cuts, rate):
+    """The bracket floors, their rates, and the tax owed on all income below
+    each floor, so a lookup is one bisect and one multiply."""
+    base = [0]
+    for i in range(len(rate)-1):
+        base.append(base[i] + (cuts[i+1] - cuts[i])*rate[i])
+    return array("q", cuts[:len(rate)]), array("d", rate), array("d", base)
+
+
+class Params():
+    """One year's parameters as flat arrays. Dollar amounts are whole, so
+    they are stored as integers and come back as ints, as the literals did."""
+    __slots__ = ("year", "brackets", "std_deduction", "eitc", "amt", "ctc_phaseout", "limits")
+
+    def __init__(self, year, spec):
+        self.year = year
+        self.brackets = tuple(bracket_table(spec["brackets"][s], spec["rates"]) for s in STATUSES)
+        # [status*(MAX_OVER65+1) + over65ct]; the last amount listed holds for higher counts.
+        std = []
+        for s in STATUSES:
+            amounts = spec["std_deduction"][s]
+            std.extend(amounts[min(k, len(amounts)-1)] for k in range(MAX_OVER65+1))
+        self.std_deduction = array("q", std)
+        self.eitc = array("q", [x for row in spec["eitc"] for x in row])   # [kids*6 + column]
+        self.amt = array("q", [x for s in STATUSES for x in spec["amt"][s]])   # [status*4 + column]
+        self.ctc_phaseout = array("q", [spec["ctc_phaseout"][s] for s in STATUSES])
+        self.limits = dict(spec["limits"])
+
+
+_loaded = dict()
+def params(year=DEFAULT_YEAR):
+    """The Params for a year, built once."""
+    p = _loaded.get(year)
+    if p is None:
+        if year not in YEARS:
+            raise ValueError("No tax parameters for %r; known years are %s"
+                             % (year, ", ".join(map(str, sorted(YEARS)))))
+        p = _loaded[year] = Params(year, YEARS[year])
+    return p
@@ -0,0 +1,140 @@
+"""The return as the filer sees it: each form's lines in order, with values.
+
+FormIndex sorts every form's cells by line once, from the Graph. Printing a
+return is then a walk over the forms the interview calls for (FORMS) and the
+lines each one shows, not a scan of every cell for every form.
+
+The renderers are generators of text chunks, one form at a time, so the CLI
+can write them as they come and the API can stream them: text (what taxes.py
+prints), json (one document, written as it goes), ndjson (one object per
+line) and csv. Each takes the cell values as a list indexed by slot, as
+Engine.evaluate() returns them.
+
+From the command line: python taxes.py forms [--format json] [-o out.json]
+reads interview.py and inform.py like taxes.py does.
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+
+from engine import load, read_answers, profile_from
+
+# (title, form, the interview answer that turns it on), in print order.
+FORMS = (
+    ("Form 1040", "f1040", None),
+    ("Schedule 1", "f1040sch1", None),
+    ("Schedule 2", "f1040sch2", None),
+    ("Schedule 3", "f1040sch3", None),
+    ("Schedule A", "f1040_sched_a", "itemizing"),
+    ("f6251: AMT", "f6251", "itemizing"),
+    ("Schedule 8812, Child Tax Credit", "ctc_sch8812_I", "kids"),
+    ("Schedule 8812, Additional Child Tax Credit", "ctc_sch8812_IIA", "kids"),
+    ("Schedule C (self-employment income)", "f1040_sched_c", "self_emp"),
+    ("Schedule SE (self-employment tax)", "sched_se", "self_emp"),
+    ("Schedule E", "f1040_sched_e", "have_rr"),
+    ("Form 8582", "f8582", "have_rr"),
+    ("Form 4562", "f4562", "have_rr"),
+    ("Form 8863: Education credits", "f8863", "s_loans"),
+    ("Form 8863ws", "f8863ws", "s_loans"),
+    ("Student loan worksheet", "student_loan_ws_1040", "s_loans"),
+    ("Qualified dividends worksheet", "qualified_dividends_ws", "cap_gains"),
+)
+
+
+class FormIndex():
+    """Each form's printable cells (line > 0), sorted by line, as
+    (line, text, name, slot, optional) tuples. Built once per Graph."""
+    def __init__(self, graph):
+        lines = dict()
+        for i, form in enumerate(graph.form):
+            if graph.line[i] > 0:
+                lines.setdefault(form, []).append((graph.line[i], graph.text[i], graph.names[i], i,
+                                                   "o" in graph.flag[i]))
+        self.lines = dict((form, tuple(sorted(rows))) for form, rows in lines.items())
+
+    def forms(self, profile):
+        """(title, form) for each form the interview answers call for."""
+        return [(title, form) for title, form, gate in FORMS if gate is None or profile.get(gate)]
+
+    def shown(self, form, values, show_optional_zeros=False):
+        """(line, text, name, value) for each line of the form that gets
+        printed: optional lines are left out when zero, unless asked for."""
+        return [(line, text, name, values[i]) for line, text, name, i, optional in self.lines.get(form, ())
+                if show_optional_zeros or not optional or values[i] != 0]
+
+
+def text_form(title, rows):
+    """One form as taxes.py prints it."""
+    width = max([len(text) for _, text, _, _ in rows] + [0])
+    return (">>>>>>>>>> %s <<<<<<<<<\n" % (title,)
+            + "".join("%4g | %*s | %g\n" % (line, width, text, value) for line, text, _, value in rows)
+            + "\n")
+
+
+def render_text(index, values, profile, show_optional_zeros=False):
+    for title, form in index.forms(profile):
+        yield text_form(title, index.shown(form, values, show_optional_zeros))
+
+
+def _line(line, text, name, value):
+    return dict(line=line, cell=name, text=text, value=round(value, 2))
+
+
+def render_json(index, values, profile, show_optional_zeros=False):
+    yield '{"forms": ['
+    for k, (title, form) in enumerate(index.forms(profile)):
+        lines = [_line(*row) for row in index.shown(form, values, show_optional_zeros)]
+        yield ("," if k else "") + json.dumps(dict(form=form, title=title, lines=lines))
+    yield "]}\n"
+
+
+def render_ndjson(index, values, profile, show_optional_zeros=False):
+    for title, form in index.forms(profile):
+        yield "".join(json.dumps(dict(_line(*row), form=form, title=title)) + "\n"
+                      for row in index.shown(form, values, show_optional_zeros))
+
+
+def render_csv(index, values, profile, show_optional_zeros=False):
+    buf = io.StringIO()
+    out = csv.writer(buf, lineterminator="\n")
+    out.writerow(("form", "line", "cell", "text", "value"))
+    for title, form in index.forms(profile):
+        for line, text, name, value in index.shown(form, values, show_optional_zeros):
+            out.writerow((form, "%g" % line, name, text, round(value, 2)))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+RENDERERS = dict(text=render_text, json=render_json, ndjson=render_ndjson, csv=render_csv)
+MEDIA_TYPES = dict(text="text/plain", json="application/json", ndjson="application/x-ndjson",
+                   csv="text/csv")
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="taxes.py forms",
+                                     description="Print every line of the return, form by form.")
+    parser.add_argument("--format", choices=sorted(RENDERERS), default="text")
+    parser.add_argument("--interview", default="interview.py")
+    parser.add_argument("--inform", default="inform.py")
+    parser.add_argument("-o", "--out", default=None, help="write here instead of stdout")
+    opts = parser.parse_args(args)
+
+    interview, inform = read_answers(opts.interview), read_answers(opts.inform)
+    try:
+        profile = profile_from(interview)
+    except ValueError as e:
+        parser.error(str(e))
+    engine = load()
+    values = engine.evaluate(profile, inform)
+    chunks = RENDERERS[opts.format](FormIndex(engine.graph), values, profile,
+                                    interview.get("show_optional_zeros", False))
+    out = open(opts.out, "w", newline="") if opts.out else sys.stdout
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if opts.out: out.close()
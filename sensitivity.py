@@ -0,0 +1,76 @@
+"""What a little more of each input would do to the bottom line.
+
+For every input cell (or a chosen few) the return is evaluated once with that
+input raised by `delta`, starting from the base values and re-running only the
+cells downstream of it. The result is the change in refund and tax owed, and the
+marginal rate: the change in (tax owed - refund) per dollar of delta.
+charitable() in taxes.py is the one-input special case.
+
+From the command line: python taxes.py sensitivity [--delta 100] [--inputs a b ...]
+reads interview.py and inform.py like taxes.py does. -w N spreads the inputs
+over N worker processes.
+"""
+
+import argparse
+import json
+import sys
+
+from engine import GraphError, load, read_answers, profile_from
+
+
+def marginal_effects(engine, profile, inputs, delta=100, names=None):
+    """One row per input: its base value, the change in refund and tax owed
+    when it goes up by delta, and the resulting marginal rate."""
+    plan = engine.plan_for(profile, prune=False)   # every input stays live
+    slots = dict(plan.inputs)
+    if names is None: names = [name for name, _ in plan.inputs]
+    for name in names:
+        if name not in slots: raise GraphError("%s is not an input cell" % (name,))
+
+    base = plan.evaluate(inputs)
+    refund, owed = engine.slots["f1040_refund"], engine.slots["f1040_tax_owed"]
+    out = []
+    for name in names:
+        v = base[:]
+        v[slots[name]] += delta
+        for i, fn in plan.downstream(name):
+            v[i] = fn(v)
+        d_refund = (v[refund] or 0) - (base[refund] or 0)
+        d_owed = (v[owed] or 0) - (base[owed] or 0)
+        out.append(dict(input=name, value=base[slots[name]],
+                        refund=round(d_refund, 2), tax_owed=round(d_owed, 2),
+                        change=round(d_owed - d_refund, 2),
+                        rate=round((d_owed - d_refund)/delta, 4) if delta else 0.))
+    return out
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="taxes.py sensitivity",
+                                     description="Marginal effect of each input on refund and tax owed.")
+    parser.add_argument("--delta", type=float, default=100)
+    parser.add_argument("--inputs", nargs="+", default=None, help="input cells to vary (default: all)")
+    parser.add_argument("--interview", default="interview.py")
+    parser.add_argument("--inform", default="inform.py")
+    parser.add_argument("-w", "--workers", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="NDJSON rows instead of a table")
+    parser.add_argument("--nonzero", action="store_true", help="only list inputs that change something")
+    opts = parser.parse_args(args)
+
+    interview, inform = read_answers(opts.interview), read_answers(opts.inform)
+    try:
+        if opts.workers > 1:
+            import parallel
+            with parallel.Pool(opts.workers) as pool:
+                rows = pool.marginal_effects(interview, inform, opts.delta, opts.inputs)
+        else:
+            rows = marginal_effects(load(), profile_from(interview), inform, opts.delta, opts.inputs)
+    except (GraphError, ValueError) as e:
+        parser.error(str(e))
+
+    for row in rows:
+        if opts.nonzero and not row["change"]: continue
+        if opts.json:
+            sys.stdout.write(json.dumps(row) + "\n")
+        else:
+            print("%-45s %12g  refund %+10.2f  owed %+10.2f  rate %+.4f"
+                  % (row["input"], row["value"], row["refund"], row["tax_owed"], row["rate"]))
@@ -1,6 +1,3 @@
-def Cv(label):
-    return cell_list[label].value
-
 exec(open("cells.py").read())
 
 def add_a_form(name):
@@ -27,65 +24,67 @@ def setup_inform(print_out):
 
 
 def print_a_form(title, fname):
-    print(">>>>>>>>>> %s <<<<<<<<<" %(title,))
-    out=list()
-    for i in cell_list.keys():
-        if (cell_list[i].form!=fname):
-            continue
-        if (show_optional_zeros or cell_list[i].value != 0 or cell_list[i].flag.find('o')==-1) and cell_list[i].line>0:
-            out.append((cell_list[i].line, cell_list[i].text, cell_list[i].value))
-    out.sort()
-    max_len = 0
-    for i in out:
-    	max_len = max(max_len, len(i[1]))
-    for i in out:
-    	print("%4g | %*s | %g" %( i[0], max_len, i[1], i[2]))
-    print("")
+    from render import text_form
+    sys.stdout.write(text_form(title, form_index.shown(fname, engine.state.values, show_optional_zeros)))
 
 def clear_done_flags(start):
-    cell_list[start].done=False
-    parents = cell_list[start].parents
-    if (parents != None):
-        for i in parents:
-            clear_done_flags(i)
-
-def get_maxcell(starting_cell, maxsofar=0, level=0):
-    maxsofar = max(maxsofar, cell_list[starting_cell].value)
-    parents = cell_list[starting_cell].parents
-    if (parents != None):
-        for i in parents:
-            maxsofar = max(maxsofar, get_maxcell(i, maxsofar, level+1))
-    return maxsofar
-
-def print_to_graphviz(starting_cell, f, level=0):
-    parents = deps[starting_cell]
-    if (parents != None):
-        for i in parents:
-            f.write("%s  -> %s \n" % (i, starting_cell))
-            print_to_graphviz(i, f, level+1)
-
-def charitable():
-    """A sample what-if scenario"""
-    for i in cell_list.keys():
+    for i in engine.dependents(start):
         cell_list[i].done=False
-    current = -cell_list['f1040_refund'].value + cell_list['f1040_tax_owed'].value
 
-    global f1040_sched_a_charity_cash
-    f1040_sched_a_charity_cash= f1040_sched_a_charity_cash+ 100
+# Both walk the graph through depgraph.py, which visits each cell once.
+def get_maxcell(starting_cell):
+    from depgraph import max_upstream
+    return max_upstream(engine, engine.state.values, starting_cell)
 
-    cell_list['f1040_refund'].compute()
-    cell_list['f1040_tax_owed'].compute()
+def print_to_graphviz(starting_cell, f):
+    from depgraph import to_dot
+    f.writelines(to_dot(engine, [starting_cell]))
 
-    new = -cell_list['f1040_refund'].value + cell_list['f1040_tax_owed'].value
-    print("If you gave another $100 to charity, your taxes would fall by $%g" % (current-new,))
+def charitable():
+    """A sample what-if scenario"""
+    from engine import PROFILE_DEFAULTS
+    from sensitivity import marginal_effects
+    profile = dict((k, globals()[k]) for k in PROFILE_DEFAULTS)
+    effect, = marginal_effects(engine, profile, globals(), 100, ['f1040_sched_a_charity_cash'])
+    print("If you gave another $100 to charity, your taxes would fall by $%g" % (0 - effect["change"],))
 
 
 
 # The main routine: build interview and inform, calculate taxes, print
 status="no interview yet"
+from params import DEFAULT_YEAR as tax_year   # interview.py may pick another
 
 import pathlib, sys
 from shutil import copyfile
+if sys.argv[1:2] == ["batch"]:
+    import parallel
+    parallel.main(sys.argv[2:])
+    sys.exit(0)
+if sys.argv[1:2] == ["sensitivity"]:
+    import sensitivity
+    sensitivity.main(sys.argv[2:])
+    sys.exit(0)
+if sys.argv[1:2] == ["optimize"]:
+    import optimize
+    optimize.main(sys.argv[2:])
+    sys.exit(0)
+if sys.argv[1:2] == ["curve"]:
+    import curve
+    curve.main(sys.argv[2:])
+    sys.exit(0)
+if sys.argv[1:2] == ["forms"]:
+    import render
+    render.main(sys.argv[2:])
+    sys.exit(0)
+if sys.argv[1:2] == ["graph"]:
+    import depgraph
+    depgraph.main(sys.argv[2:])
+    sys.exit(0)
+if sys.argv[1:2] == ["bench"]:
+    import bench
+    bench.main(sys.argv[2:])
+    sys.exit(0)
+
 if (not pathlib.Path("interview.py").exists()):
     copyfile("interview_template.py", "interview.py")
     print("Have generated interview.py. Please fill it in and rerun this script.")
@@ -114,41 +113,31 @@ from inform import *
 setup_inform(print_out=False)
 
 
+from engine import Engine
+engine = Engine(cell_list, deps, globals())
+if debug:
+    from tracing import Trace
+    engine.trace = Trace(engine.graph)
+engine.compute()
 
-cell_list['f1040_refund'].compute()
-cell_list['f1040_tax_owed'].compute()
-cell_list['f8582_carryover_to_next_year'].compute()
-print_a_form("Form 1040", "f1040")
-print_a_form("Schedule 1", "f1040sch1")
-print_a_form("Schedule 2", "f1040sch2")
-print_a_form("Schedule 3", "f1040sch3")
-if itemizing:
-    print_a_form("Schedule A", "f1040_sched_a")
-    print_a_form("f6251: AMT", "f6251")
-if kids:
-    print_a_form("Schedule 8812, Child Tax Credit", "ctc_sch8812")
-    print_a_form("CTC worksheet", "ctc_ws_1040")
-if self_emp:
-    print_a_form("Schedule C (self-employment income)", "f1040_sched_c")
-    print_a_form("Schedule SE (self-employment tax)", "sched_se")
-if have_rr:
-    print_a_form("Schedule E", "f1040_sched_e")
-    print_a_form("Form 8582", "f8582")
-    print_a_form("Form 4562", "f4562")
-if s_loans:
-    print_a_form("Form 8863: Education credits", "f8863")
-    print_a_form("Form 8863ws", "f8863ws")
-    print_a_form("Student loan worksheet", "student_loan_ws_1040")
-if cap_gains:
-    print_a_form("Qualified dividends worksheet", "qualified_dividends_ws")
+# Which forms print, and in what order, is render.FORMS.
+from engine import PROFILE_DEFAULTS
+from render import FormIndex, render_text
+form_index = FormIndex(engine.graph)
+for chunk in render_text(form_index, engine.state.values,
+                         dict((k, globals()[k]) for k in PROFILE_DEFAULTS), show_optional_zeros):
+    sys.stdout.write(chunk)
 
 
 
 f=open("graph.dot", "w")
-f.write("digraph {")
 print_to_graphviz('f1040_refund', f)
-f.write("}")
 f.close()
 
 if itemizing:
-    charitable()
\ No newline at end of file
+    charitable()
+
+if debug:
+    engine.trace.save("trace.json")
+    print(engine.trace.report())
+    print("Wrote trace.json; open it in chrome://tracing or ui.perfetto.dev.")
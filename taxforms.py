@@ -1,4 +1,7 @@
-###AUTOGENERATED via m4. Please edit the sources.
+###AUTOGENERATED by formc.py. Please edit the sources.
+# Kept in the repo with local changes to the helpers below (the params.py year
+# tables, bisect lookups, logging); don't regenerate over it. `make
+# upstream-forms` writes the upstream version to taxforms.upstream.py to merge.
 
 #in python at the moment, situations are just plain booleans
 def Situation(x):
@@ -7,63 +10,34 @@ def Situation(x):
 def fstatus():
     return status
 
-#tax rate schedules---a reformat from the JS version above.
-def tax_table(inval):
-    filing_status = fstatus()
+# The year-specific amounts live in params.py, one table per tax year. Each
+# helper takes the year as an argument or, like fstatus(), from the interview.
+from params import params, STATUS_INDEX, MAX_OVER65
 
-    if filing_status == "single":
-        cuts=[0, 11600, 47150, 100525, 191950, 243725, 609350, 1e20]
-    if filing_status == "married filing separately":
-        cuts=[0, 11600, 47150, 100525, 191950, 243725, 365600, 1e20]
-    if filing_status == "married filing jointly":
-        cuts=[0, 23200, 94300, 201050, 383900, 487450, 731200, 1e20]
-    if filing_status == "head of household":
-        cuts=[0, 16550, 63100, 100500, 191950, 243700, 609350,1e20]
+# Helper warnings go to a logger, not stdout: they would otherwise be
+# printed once per return (and per point when curve.py samples a cell).
+import logging
+log = logging.getLogger("taxforms")
 
-    rate=[0.1, 0.12, 0.22 , 0.24 ,0.32, 0.35, 0.37]
-    i=0
-    total=0
-    while inval>=cuts[i]:
-        # Finds how much of inval (income) falls into that bracket
-        total = total + (min(inval,cuts[i+1]) - cuts[i])*rate[i]
-        i = i+1
-    return total
+from bisect import bisect_right
+def tax_table(inval, year=None):
+    cuts, rate, base = params(year or tax_year).brackets[STATUS_INDEX[fstatus()]]
+    if inval < cuts[0]: return 0
+    i = bisect_right(cuts, inval) - 1
+    return base[i] + (inval - cuts[i])*rate[i]
 
 # The tax tables break income into $50 ranges, then uses the midpoint.
-def tax_calc(inval):
+def tax_calc(inval, year=None):
     if inval == 0: return 0
-    if inval >=100000: return tax_table(inval)
-    return tax_table(round(inval/50)*50 + 25)
+    if inval >=100000: return tax_table(inval, year)
+    return tax_table(round(inval/50)*50 + 25, year)
 
-def std_ded_fn():
+def std_ded_fn(year=None):
     over65ct = Situation(over_65) + Situation(spouse_over_65)
-    if fstatus() == "single":
-         if (over65ct==0):  return 14600
-         if (over65ct==1):  return 16550
-         else: return 18500
+    return params(year or tax_year).std_deduction[STATUS_INDEX[fstatus()]*(MAX_OVER65+1) + over65ct]
 
-    if fstatus() == "married filing jointly":
-         if (over65ct==0): return 29200
-         if (over65ct==1): return 30750
-         if (over65ct==2): return 32300
-         if (over65ct==3): return 33850
-         else:  return 35400
 
-    if fstatus() == "married filing separately":
-         if (over65ct==0): return 14600
-         if (over65ct==1): return 16150
-         if (over65ct==2): return 17700
-         if (over65ct==3): return 19250
-         else:  return 20800
-
-    if fstatus() == "head of household":
-         if (over65ct==0): return 21900
-         if (over65ct==1): return 23850
-         else: return 25800
-
-
-
-def eitc(income, kids):
+def eitc(income, kids, year=None):
     #See https://www.taxpolicycenter.org/statistics/eitc-parameters
     # Or, search the internet for the phrase "For taxable years beginning in 20xx, the following amounts are used to determine the earned income credit under § 32(b)."
     # For 2019: https://www.irs.gov/irb/2018-49_IRB
@@ -73,31 +47,28 @@ def eitc(income, kids):
     # In the footnotes of that page, you'll find sources. For 23, I went straigtht to the IRB: https://www.irs.gov/pub/irs-irbs/irb22-45.pdf
     #plateu start, plateu value, plateu end, zero point, phaseout for married joint, phaseout end for mj
 
-    data=[[8260, 632, 10330, 18591,    17250, 25511],
-          [12390, 4213, 22720, 49084, 29640, 56004],
-          [17400, 6960, 22720, 55768, 29640, 62688],
-          [17400, 7830, 22720, 59899, 29640, 66819]]
-    row=kids if kids <=3 else 3
+    data=params(year or tax_year).eitc
+    row=(kids if kids <=3 else 3)*6
 
-    plateu_start=0
-    plateu_value=1
+    plateu_start=row
+    plateu_value=row+1
 
     if status=="married filing separately": return 0
     if status=="married filing jointly":
-        phaseout_start=4
-        phaseout_end=5
+        phaseout_start=row+4
+        phaseout_end=row+5
     else:
-        phaseout_start=2
-        phaseout_end=3
-
-    if income < 0: print("Negative income! (%s) Please fix." % (income,))
-    if income >= data[row][phaseout_end]: return 0
-    if income >= data[row][phaseout_start]:
-        return round(100*data[row][plateu_value]*(1-(income-data[row][phaseout_start])
-                                            /(data[row][phaseout_end]-data[row][phaseout_start])))/100
-    if income <= data[row][plateu_start]:
-        return round(income*data[row][plateu_value]/data[row][plateu_start])/100;
-    return data[row][plateu_value]
+        phaseout_start=row+2
+        phaseout_end=row+3
+
+    if income < 0: log.debug("Negative income! (%s) Please fix.", income)
+    if income >= data[phaseout_end]: return 0
+    if income >= data[phaseout_start]:
+        return round(100*data[plateu_value]*(1-(income-data[phaseout_start])
+                                            /(data[phaseout_end]-data[phaseout_start])))/100
+    if income <= data[plateu_start]:
+        return round(income*data[plateu_value]/data[plateu_start])/100;
+    return data[plateu_value]
 
 def actc(limited_unused, scaled_income, ss_med, eitc):
     if kids >=3:
@@ -128,31 +99,26 @@ from math import ceil
 def Ceil(x):
     return ceil(x)
 
-def ctc_status(agi):
-    ded=0;
-    status = fstatus();
-    if (status=="married filing jointly"): ded=400000
-    else: ded=200000
+def ctc_status(agi, year=None):
+    ded = params(year or tax_year).ctc_phaseout[STATUS_INDEX[fstatus()]]
     diff = max(agi-ded, 0)
     return ceil(diff/1000.)*1000*0.05
 
 
-def get_amt_exemption(income):
-    if (status=="single" or status=="head of household") and income < 609350:
-        return 85700
-    if (status=="married filing jointly") and income < 1218700:
-        return 133300
-    if (status=="married filing separately") and income < 609350:
-        return 66650
-    print("AMT exemption is partially implemented.")
+# AMT parameters per status: exemption, where it stops, 28% start, subtraction.
+def get_amt_exemption(income, year=None):
+    i = STATUS_INDEX.get(fstatus())
+    if i is not None:
+        amt = params(year or tax_year).amt
+        if income < amt[i*4+1]: return amt[i*4]
+    log.debug("AMT exemption is partially implemented.")
     return 0
 
-def get_tamt(income):
+def get_tamt(income, year=None):
     if income<=0: return 0
-    if status=="married filing separately":
-        return income * (0.26 if income <=116300  else 0.28) - 2326
-    else:
-        return income * (0.26 if income <=232600 else 0.28) - 4652
+    amt = params(year or tax_year).amt
+    i = STATUS_INDEX[fstatus()]*4
+    return income * (0.26 if income <= amt[i+2] else 0.28) - amt[i+3]
 
 def med_expenses(expenses, agi):
     if (not (over_65 or  spouse_over_65)): return 0
@@ -276,7 +242,7 @@ f8582_div_85821 = [],
 f8582_div_85822 = [],
 f8582_f8582_net_in = ["f8582_ws1_8582_net_gain", ],
 f8582_f8582_net_loss = ["f8582_ws1_8582_net_loss", ],
-f8582_f8582_carryover = ["f8582_ws1_8582_prior_loss", "f8582_ws1_8582_prior_loss", "f8582_ws1_8582_prior_loss", ],
+f8582_f8582_carryover = ["f8582_ws1_8582_prior_loss", ],
 f8582_f8582_total_real_in = ["f8582_f8582_net_in", "f8582_f8582_net_loss", "f8582_f8582_carryover", ],
 f8582_f8582_commercial_revitalization = [],
 f8582_f8582_passive_activities = ["f8582_f8582_total_real_in", ],
@@ -290,13 +256,13 @@ f8582_total_losses_8582 = ["f8582_f8582_total_real_in", "f8582_f8582_net_loss",
 f8863_pt3_divider = [],
 f8863_education_expenses_1 = [],
 f8863_scaled_education_expenses_1 = ["f8863_education_expenses_1", ],
-f8863_rescaled_education_expenses_1 = ["f8863_education_expenses_1", "f8863_education_expenses_1", "f8863_scaled_education_expenses_1", ],
+f8863_rescaled_education_expenses_1 = ["f8863_education_expenses_1", "f8863_scaled_education_expenses_1", ],
 f8863_education_expenses_2 = [],
 f8863_scaled_education_expenses_2 = ["f8863_education_expenses_2", ],
-f8863_rescaled_education_expenses_2 = ["f8863_education_expenses_2", "f8863_education_expenses_2", "f8863_scaled_education_expenses_2", ],
+f8863_rescaled_education_expenses_2 = ["f8863_education_expenses_2", "f8863_scaled_education_expenses_2", ],
 f8863_education_expenses_3 = [],
 f8863_scaled_education_expenses_3 = ["f8863_education_expenses_3", ],
-f8863_rescaled_education_expenses_3 = ["f8863_education_expenses_3", "f8863_education_expenses_3", "f8863_scaled_education_expenses_3", ],
+f8863_rescaled_education_expenses_3 = ["f8863_education_expenses_3", "f8863_scaled_education_expenses_3", ],
 f8863_adjusted_qualified_expenses = [],
 f8863_pt1_divider = [],
 f8863_total_limited_expenses = ["f8863_rescaled_education_expenses_1", "f8863_rescaled_education_expenses_2", "f8863_rescaled_education_expenses_3", ],
@@ -351,7 +317,7 @@ f1040_sched_c_expenses = [],
 f1040_sched_c_home_expenses = [],
 f1040_sched_c_net_pl = ["f1040_sched_c_gross_income", "f1040_sched_c_expenses", "f1040_sched_c_home_expenses", ],
 sched_se_in_from_sch_c = ["f1040_sched_c_net_pl", ],
-sched_se_net_pl_reduced = ["sched_se_in_from_sch_c", "sched_se_in_from_sch_c", "sched_se_in_from_sch_c", ],
+sched_se_net_pl_reduced = ["sched_se_in_from_sch_c", ],
 sched_se_ss_wages = [],
 sched_se_distance_to_max = ["sched_se_ss_wages", ],
 sched_se_twelve_pct = ["sched_se_distance_to_max", "sched_se_net_pl_reduced", ],
@@ -375,13 +341,14 @@ f1040_sched_e_total_rental_expenses = ["f1040_sched_e_rental_advertising", "f104
 f1040_sched_e_net_rents = ["f1040_sched_e_rents_received", "f1040_sched_e_total_rental_expenses", ],
 f1040_sched_e_net_royalties = ["f1040_sched_e_royalties_received", "f1040_sched_e_royalty_expenses", ],
 f1040_sched_e_deductible_rr_losses = ["f8582_total_losses_8582", ],
-f1040_sched_e_post_8582_net_rents = ["f1040_sched_e_net_rents", "f1040_sched_e_net_rents", "f1040_sched_e_deductible_rr_losses", "f1040_sched_e_deductible_rr_losses", ],
+f1040_sched_e_post_8582_net_rents = ["f1040_sched_e_net_rents", "f1040_sched_e_deductible_rr_losses", ],
 f1040_sched_e_sched_e_income = ["f1040_sched_e_post_8582_net_rents", "f1040_sched_e_net_royalties", ],
 f1040_sched_e_rr_losses = ["f1040_sched_e_post_8582_net_rents", "f1040_sched_e_net_royalties", ],
 f1040_sched_e_rr_income = ["f1040_sched_e_sched_e_income", "f1040_sched_e_rr_losses", ],
 f4562_rental_property_value = [],
 f4562_rental_property_depreciation = ["f4562_rental_property_value", ],
  )
+deps_verified = True   # formc.py checked deps against the calcs
 
 cell_list = dict(
 f1040sch1_state_tax_refunds = cell("Taxable state refunds", 1, "", flag="u    ", name="f1040sch1_state_tax_refunds", form="f1040sch1"),
@@ -0,0 +1,95 @@
+"""Record where an evaluation spends its time.
+
+Set engine.trace = Trace(engine.graph) (or the `trace` global that cells.py
+defines, for cell.compute()) and every cell evaluated is timed and counted;
+cells found already done count as hits. Leave it at None and the engine
+runs its plain loop, with nothing recorded and nothing printed.
+
+A trace exports as JSON (per cell and per form: calls, hits, total time,
+fan-in) or as Chrome trace events, which chrome://tracing and Perfetto open
+directly, one bar per cell evaluation grouped by form.
+"""
+
+import json
+from collections import Counter
+from time import perf_counter_ns
+
+
+class Trace():
+    def __init__(self, graph=None, events=True):
+        """graph (an engine.Graph) supplies each cell's form and fan-in.
+        events=False keeps only the per-cell totals, not each evaluation."""
+        self.graph = graph
+        self.keep_events = events
+        self.events = []    # (name, start ns, end ns)
+        self.calls = Counter()
+        self.hits = Counter()
+        self.time_ns = Counter()
+        self.origin = perf_counter_ns()
+
+    def cell(self, name, start, end):
+        self.calls[name] += 1
+        self.time_ns[name] += end - start
+        if self.keep_events: self.events.append((name, start, end))
+
+    def hit(self, name):
+        self.hits[name] += 1
+
+    def _form(self, name):
+        g = self.graph
+        return g.form[g.slots[name]] if g is not None and name in g.slots else ""
+
+    def _fan_in(self, name):
+        g = self.graph
+        return len(g.parents[g.slots[name]]) if g is not None and name in g.slots else None
+
+    def cells(self):
+        """One row per cell seen, slowest first."""
+        names = set(self.calls) | set(self.hits)
+        rows = [dict(name=n, form=self._form(n), calls=self.calls[n], hits=self.hits[n],
+                     time_us=self.time_ns[n] / 1000., fan_in=self._fan_in(n))
+                for n in names]
+        rows.sort(key=lambda r: -r["time_us"])
+        return rows
+
+    def forms(self):
+        """Totals per form, slowest first."""
+        out = dict()
+        for r in self.cells():
+            f = out.setdefault(r["form"], dict(form=r["form"], cells=0, calls=0, hits=0, time_us=0.))
+            f["cells"] += 1
+            f["calls"] += r["calls"]
+            f["hits"] += r["hits"]
+            f["time_us"] += r["time_us"]
+        return sorted(out.values(), key=lambda f: -f["time_us"])
+
+    def to_json(self):
+        return dict(total_us=sum(self.time_ns.values()) / 1000.,
+                    forms=self.forms(), cells=self.cells())
+
+    def to_chrome(self):
+        """Trace Event Format: one complete ("X") event per evaluation, in
+        microseconds since the trace started, with one thread row per form."""
+        tids = dict()
+        events = []
+        for name, start, end in self.events:
+            form = self._form(name)
+            tid = tids.setdefault(form, len(tids) + 1)
+            events.append(dict(name=name, cat=form, ph="X", pid=1, tid=tid,
+                               ts=(start - self.origin) / 1000., dur=(end - start) / 1000.))
+        for form, tid in tids.items():
+            events.append(dict(name="thread_name", ph="M", pid=1, tid=tid, args=dict(name=form or "cells")))
+        return dict(traceEvents=events, displayTimeUnit="ns")
+
+    def save(self, path, format="chrome"):
+        with open(path, "w") as f:
+            json.dump(self.to_chrome() if format == "chrome" else self.to_json(), f)
+
+    def report(self, top=5):
+        """A few lines for a terminal."""
+        total = sum(self.time_ns.values()) / 1000.
+        lines = ["%d cell evaluations, %d hits, %.1f us in calcs"
+                 % (sum(self.calls.values()), sum(self.hits.values()), total)]
+        for f in self.forms()[:top]:
+            lines.append("  %-25s %8.1f us  %4d calls" % (f["form"], f["time_us"], f["calls"]))
+        return "\n".join(lines)